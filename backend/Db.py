@@ -1,23 +1,68 @@
-import sqlite3
+import json
+import connections
+import migrations
 import SteamStoreAPI as ssa
+import events
+import instrumentation
+import scheduler
 
 _filename = "steam_games.db"
 
+# Relation, id column and name table of the lists in get_app_details
+_RELATIONS = (
+    ("game_categories", "cid", "categories"),
+    ("game_tags", "tid", "tags"),
+    ("game_developers", "did", "developers"),
+    ("game_publishers", "pid", "publishers"),
+)
+
 
 class Db:
     def __init__(self, filename):
         self.filename = filename
         self.meta_tables = ['categories', 'tags', 'developers', 'publishers']
+        # {table_name: {name: id}} cache used by insert_games
+        self._item_ids = {}
+        # Column names of the games table, read once
+        self._game_columns = None
+        self._names = {}  # table name -> {id: name}
 
     def get_app_list(self):
-        with sqlite3.connect(self.filename) as conn:
+        with connections.read(self.filename) as conn:
             appids = conn.execute("SELECT appid FROM games;").fetchall()
             return [id[0] for id in appids]
 
     def get_app_details(self, appid):
-        with sqlite3.connect(self.filename) as conn:
+        """
+        Fetch a game and the names of its categories, tags, developers and
+        publishers
+
+        Params:
+            appid (int): Steam appid
+
+        Returns:
+            dict: Every column of the game, plus lists of categories, tags,
+                developers and publishers. None if the appid is unknown.
+        """
+        return self.get_app_details_many([appid]).get(int(appid))
+
+    def get_app_details_many(self, appids):
+        """
+        Fetch the details of many games with one query per table, whatever
+        their number
+
+        Params:
+            appids (iterable[int]): Steam appids
+
+        Returns:
+            dict: {appid: details} of the appids that are in the database,
+                details being the same as get_app_details
+        """
+        ids = json.dumps(sorted({int(a) for a in appids}))
+        details = {}
+        with connections.read(self.filename) as conn:
             cur = conn.cursor()
-            game = cur.execute(
+            games = cur.execute(
                 """
                 SELECT
                     g.appid,
@@ -32,59 +77,58 @@ class Db:
                     g.header_image,
                     g.positive_reviews,
                     g.negative_reviews,
-                    g.total_reviews,
-                    GROUP_CONCAT(DISTINCT c.name) AS categories,
-                    GROUP_CONCAT(DISTINCT t.name) AS tags,
-                    GROUP_CONCAT(DISTINCT d.name) AS developers,
-                    GROUP_CONCAT(DISTINCT p.name) AS publishers
+                    g.total_reviews
                 FROM games g
+                WHERE g.appid IN (SELECT value FROM json_each(?));
+                """, (ids,)).fetchall()
+
+            for game in games:
+                details[game[0]] = {
+                        "appid": game[0],
+                        "name": game[1],
+                        "controller_support": game[2],
+                        "has_achievements": game[3],
+                        "supports_windows": game[4],
+                        "supports_mac": game[5],
+                        "supports_linux": game[6],
+                        "price": game[7],
+                        "release_date": game[8],
+                        "header_image": game[9],
+                        "positive_reviews": game[10],
+                        "negative_reviews": game[11],
+                        "total_reviews": game[12],
+                        "categories": [],
+                        "tags": [],
+                        "developers": [],
+                        "publishers": []
+                        }
+
+            for relation, idname, table_name in _RELATIONS:
+                # Read in (appid, id) index order, nothing to sort
+                rows = cur.execute(f"""
+                                   SELECT appid, {idname} FROM {relation}
+                                   WHERE appid IN
+                                       (SELECT value FROM json_each(?))
+                                   ORDER BY appid, {idname};
+                                   """, (ids,)).fetchall()
+                names = self._item_names(cur, table_name,
+                                         {item for _, item in rows})
+                for appid, item in rows:
+                    if appid in details:
+                        details[appid][table_name].append(names[item])
 
-                LEFT JOIN game_categories gc ON g.appid = gc.appid
-                LEFT JOIN categories c ON gc.cid = c.id
-
-                LEFT JOIN game_tags gt ON g.appid = gt.appid
-                LEFT JOIN tags t ON gt.tid = t.id
-
-                LEFT JOIN game_developers gd ON g.appid = gd.appid
-                LEFT JOIN developers d ON gd.did = d.id
-
-                LEFT JOIN game_publishers gp ON g.appid = gp.appid
-                LEFT JOIN publishers p ON gp.pid = p.id
-
-                WHERE g.appid = ?
-                GROUP BY g.appid;
-                """, ((appid,))
-            ).fetchone()
-
-            if game is None:
-                return None
-
-            categories = game[13].split(',') if game[13] else []
-            tags = game[14].split(',') if game[14] else []
-            developers = game[15].split(',') if game[15] else []
-            publishers = game[16].split(',') if game[16] else []
-
-            details = {
-                    "appid": game[0],
-                    "name": game[1],
-                    "controller_support": game[2],
-                    "has_achievements": game[3],
-                    "supports_windows": game[4],
-                    "supports_mac": game[5],
-                    "supports_linux": game[6],
-                    "price": game[7],
-                    "release_date": game[8],
-                    "header_image": game[9],
-                    "positive_reviews": game[10],
-                    "negative_reviews": game[11],
-                    "total_reviews": game[12],
-                    "categories": categories,
-                    "tags": tags,
-                    "developers": developers,
-                    "publishers": publishers
-                    }
             return details
 
+    def _item_names(self, cur, table_name, ids):
+        # {id: name} of a tags, categories, developers or publishers table,
+        # cached: rows are only ever added, so the table is read again only
+        # when an id is not in the cache yet
+        names = self._names.get(table_name)
+        if names is None or not ids <= names.keys():
+            names = dict(cur.execute(f"SELECT id, name FROM {table_name};"))
+            self._names[table_name] = names
+        return names
+
     def query_game_by_appid(self, appid):
         """
         Fetch a game row by its appid
@@ -95,47 +139,78 @@ class Db:
         Returns:
             tuple: All values related to the game
         """
-        with sqlite3.connect(self.filename) as conn:
+        with connections.read(self.filename) as conn:
             cur = conn.cursor()
             game = cur.execute(
                     "SELECT * FROM games WHERE appid = ?",
                     (appid,)).fetchone()
             return game if game else None
 
-    def query_appid_by_name(self, name):
+    def query_names_by_appid(self, appids):
         """
-        Fetch all appids of games matching the given name pattern
+        Fetch the names of many games with one query
+
+        Params:
+            appids (iterable[int]): Steam appids
+
+        Returns:
+            dict: {appid: name} of the appids that are in the database
+        """
+        with connections.read(self.filename) as conn:
+            cur = conn.cursor()
+            names = cur.execute(
+                    """
+                    SELECT g.appid, g.name
+                    FROM json_each(?) AS j
+                    JOIN games g ON g.appid = j.value;
+                    """,
+                    (json.dumps([int(a) for a in appids]),)).fetchall()
+            return dict(names)
+
+    def query_appid_by_name(self, name, limit=100):
+        """
+        Fetch the appids of games whose name contains the given pattern
 
         Params:
             name (string): Game name
+            limit (int): Maximum number of appids, lowest first
 
         Returns:
             array[int]: All appids matching the pattern
         """
-        with sqlite3.connect(self.filename) as conn:
+        with connections.read(self.filename) as conn:
             cur = conn.cursor()
+            # The trigram index of game_search serves LIKE '%...%'
             appids = cur.execute(
                     """
-                    SELECT appid FROM games
-                    WHERE name LIKE ?;
+                    SELECT rowid FROM game_search
+                    WHERE name LIKE ?
+                    ORDER BY rowid
+                    LIMIT ?;
                     """,
-                    (f"%{name}%",)).fetchall()
+                    (f"%{name}%", limit,)).fetchall()
             return [t[0] for t in appids] if appids else []
 
-    def query_game_by_name(self, name):
+    def query_game_by_name(self, name, limit=20):
         """
-        Fetch a game row by its name
+        Fetch the rows of games by their name
 
         Params:
             name (string): The game's name (partial match supported)
+            limit (int): Maximum number of rows, lowest appids first
 
         Returns:
-            tuple: All values related to the game
+            list[tuple]: All values related to every matching game
         """
-        with sqlite3.connect(self.filename) as conn:
+        with connections.read(self.filename) as conn:
             cur = conn.cursor()
-            game = cur.execute("SELECT * FROM games WHERE name LIKE ?",
-                               (f"%{name}%",)).fetchall()
+            game = cur.execute("""
+                               SELECT g.* FROM game_search s
+                               JOIN games g ON g.appid = s.rowid
+                               WHERE s.name LIKE ?
+                               ORDER BY s.rowid
+                               LIMIT ?
+                               """, (f"%{name}%", limit,)).fetchall()
             return game if game else None
 
     def query_games_by_tags(self, tids, match_all=True):
@@ -149,7 +224,7 @@ class Db:
         Returns:
             A list of games matching the filter
         """
-        with sqlite3.connect(self.filename) as conn:
+        with connections.read(self.filename) as conn:
             if len(tids) == 0:
                 return []
             cur = conn.cursor()
@@ -181,7 +256,7 @@ class Db:
         Returns:
             A list of games matching the filter
         """
-        with sqlite3.connect(self.filename) as conn:
+        with connections.read(self.filename) as conn:
             if len(cids) == 0:
                 return []
             cur = conn.cursor()
@@ -229,7 +304,7 @@ class Db:
             case _:
                 return None
 
-        with sqlite3.connect(self.filename) as conn:
+        with connections.read(self.filename) as conn:
             cur = conn.cursor()
 
             categories = cur.execute(f"""
@@ -252,7 +327,7 @@ class Db:
         Returns:
             string or list[string]: Name(s) associated with the id(s).
         """
-        with sqlite3.connect(self.filename) as conn:
+        with connections.read(self.filename) as conn:
             cur = conn.cursor()
 
             if table_name not in self.meta_tables:
@@ -292,17 +367,30 @@ class Db:
         if table_name not in self.meta_tables:
             return None
 
-        with sqlite3.connect(self.filename) as conn:
+        kind = migrations.SEARCH_KINDS.get(table_name)
+        with connections.read(self.filename) as conn:
             cur = conn.cursor()
-            cat = cur.execute(f"""
-                              SELECT id FROM {table_name}
-                              WHERE name LIKE ?
-                              """, (f"%{name}%",)).fetchone()
+            # An exact name is a lookup in the name's unique index
+            cat = cur.execute(f"SELECT id FROM {table_name} WHERE name = ?",
+                              (name,)).fetchone()
+            if cat is None and kind is not None:
+                # Tags, developers and publishers are in item_search
+                cat = cur.execute("""
+                                  SELECT rowid / 4 FROM item_search
+                                  WHERE name LIKE ? AND rowid % 4 = ?
+                                  ORDER BY rowid
+                                  LIMIT 1
+                                  """, (f"%{name}%", kind,)).fetchone()
+            elif cat is None:
+                cat = cur.execute(f"""
+                                  SELECT id FROM {table_name}
+                                  WHERE name LIKE ?
+                                  """, (f"%{name}%",)).fetchone()
             return cat[0] if cat else None
 
     def query_game_count(self):
         # Total number of games
-        with sqlite3.connect(self.filename) as conn:
+        with connections.read(self.filename) as conn:
             cur = conn.cursor()
             count = cur.execute("SELECT COUNT(*) FROM games")
             return count.fetchone()[0]
@@ -321,37 +409,75 @@ class Db:
         if table_name not in self.meta_tables:
             return None
 
-        with sqlite3.connect(self.filename) as conn:
+        with connections.read(self.filename) as conn:
             cur = conn.cursor()
             count = cur.execute(f"SELECT COUNT(*) FROM {table_name}")
             return count.fetchone()[0]
 
     def get_game_table_column_names(self):
-        # List of the column names
-        with sqlite3.connect(self.filename) as conn:
-            cur = conn.cursor()
-            cur.execute("PRAGMA table_info(games)")
-            attributes = [row[1] for row in cur.fetchall()]
-            return attributes
+        # List of the column names, cached: the schema only changes through
+        # migrations, which run before the first query
+        if self._game_columns is None:
+            with connections.read(self.filename) as conn:
+                cur = conn.cursor()
+                cur.execute("PRAGMA table_info(games)")
+                self._game_columns = [row[1] for row in cur.fetchall()]
+        return self._game_columns
+
+    def insert_game_by_appid(self, appid, priority=scheduler.INTERACTIVE):
+        app = ssa.get_steam_app_details(appid, priority)
+
+        status, info = self.parse_store_details(appid, app)
+        if status != 0:
+            return status
+
+        appss = ssa.get_steam_app_details_steamspy(appid, priority)
+        self.add_steamspy_details(info, appss)
 
-    def insert_game_by_appid(self, appid):
-        app = ssa.get_steam_app_details(appid)
+        self.insert_games([info])
+        return 0  # success
 
+    def parse_store_details(self, appid, app):
+        """
+        Turn a Steam store appdetails response into a games row
+
+        Params:
+            appid (int): The requested appid
+            app (dict): Response of SteamStoreAPI.get_steam_app_details
+
+        Returns:
+            (int, dict): Status and row info. Status is one of:
+                0: success
+                -1: Invalid response
+                -2: App does not exist
+                -3: Not a game
+        """
         if not app:
             print("Invalid response")
-            return -1 # Invalid response
+            return -1, None # Invalid response
 
         appdata = app.get(str(appid))
         if not appdata or not appdata.get("success"):
-            return -2 # App does not exist
+            return -2, None # App does not exist
 
         appdata = appdata.get("data")
         if appdata.get("type") != "game":
-            return -3 # Not a game
+            return -3, None # Not a game
+
+        supp = appdata.get("controller_support", None)
+        if supp == "none":
+            supp = 0
+        elif supp == "partial":
+            supp = 1
+        elif supp == "full":
+            supp = 2
+        else:
+            supp = 3
 
         info = {
+            "appid": appid,
             "name": appdata.get("name"),
-            "controller_support": appdata.get("controller_support", None),
+            "controller_support": supp,
             "has_achievements": True if appdata.get("achievements") else False,
             "supports_windows": appdata.get("platforms", {}).get("windows", False),
             "supports_mac": appdata.get("platforms", {}).get("mac", False),
@@ -361,8 +487,16 @@ class Db:
             "release_date": appdata.get("release_date", {}).get("date"),
             "header_image": appdata.get("header_image"),
         }
+        return 0, info
 
-        appss = ssa.get_steam_app_details_steamspy(appid)
+    def add_steamspy_details(self, info, appss):
+        """
+        Add reviews, tags, developers and publishers to a parsed row
+
+        Params:
+            info (dict): Output of parse_store_details
+            appss (dict): Response of get_steam_app_details_steamspy
+        """
         if appss.get("success"):
             info["reviews_positive"] = appss.get("reviews_positive")
             info["reviews_negative"] = appss.get("reviews_negative")
@@ -378,125 +512,170 @@ class Db:
             info["developers"] = []
             info["publishers"] = []
 
-        supp = info["controller_support"]
-        if supp == "none":
-            supp = 0
-        elif supp == "partial":
-            supp = 1
-        elif supp == "full":
-            supp = 2
-        else:
-            supp = 3
+    def insert_games(self, infos):
+        """
+        Write many parsed games in one transaction
+
+        Params:
+            infos (list[dict]): Rows from parse_store_details, completed
+                by add_steamspy_details
+
+        Returns:
+            int: Number of games written
+        """
+        if not infos:
+            return 0
 
-        # Insert any potential new developers/publishers/tags
-        developers = info.get("developers")
-        publishers = info.get("publishers")
-        tags = info.get("tags")
-        with sqlite3.connect(self.filename) as conn:
+        with connections.write(self.filename) as conn:
             cur = conn.cursor()
-            for developer in developers:
-                cur.execute("""
-                            INSERT OR IGNORE INTO developers (name)
-                            VALUES (?);
-                            """, (developer,))
-
-            for publisher in publishers:
-                cur.execute("""
-                            INSERT OR IGNORE INTO publishers (name)
-                            VALUES (?);
-                            """, (publisher,))
-
-            for tag in tags:
-                cur.execute("""
-                            INSERT OR IGNORE INTO tags (name)
-                            VALUES (?);
-                            """, (tag,))
 
+            # Resolve (and create) every developer/publisher/tag id at once
+            ids = {}
+            for table_name in ("developers", "publishers", "tags"):
+                names = {n for info in infos for n in info[table_name]}
+                ids[table_name] = self._resolve_item_ids(cur, table_name,
+                                                         names)
+
+            cur.executemany("""
+                            INSERT OR REPLACE INTO games (
+                                appid, name, controller_support, has_achievements,
+                                supports_windows, supports_mac, supports_linux,
+                                price, release_date, header_image,
+                                positive_reviews, negative_reviews, total_reviews
+                                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                            """, [(
+                                info["appid"],
+                                info["name"],
+                                info["controller_support"],
+                                info["has_achievements"],
+                                info["supports_windows"],
+                                info["supports_mac"],
+                                info["supports_linux"],
+                                info["price"],
+                                info["release_date"],
+                                info["header_image"],
+                                info["reviews_positive"],
+                                info["reviews_negative"],
+                                info["reviews_total"]
+                                ) for info in infos])
+
+            for relation, idname, key in (("game_developers", "did", "developers"),
+                                          ("game_publishers", "pid", "publishers"),
+                                          ("game_tags", "tid", "tags")):
+                cur.executemany(f"""
+                                INSERT OR IGNORE INTO {relation} (appid, {idname})
+                                VALUES (?, ?);
+                                """, [(info["appid"], ids[key][name])
+                                      for info in infos
+                                      for name in info[key]])
+
+            for info in infos:
+                version = self._record_change(cur, info["appid"], "insert")
             conn.commit()
 
-        # Insert app data into db
-        with sqlite3.connect(self.filename) as conn:
-            cur = conn.cursor()
-            cur.execute("""
-                        INSERT OR REPLACE INTO games (
-                            appid, name, controller_support, has_achievements,
-                            supports_windows, supports_mac, supports_linux,
-                            price, release_date, header_image,
-                            positive_reviews, negative_reviews, total_reviews
-                            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                        """, (
-                            appid,
-                            info["name"],
-                            supp,
-                            info["has_achievements"],
-                            info["supports_windows"],
-                            info["supports_mac"],
-                            info["supports_linux"],
-                            info["price"],
-                            info["release_date"],
-                            info["header_image"],
-                            info["reviews_positive"],
-                            info["reviews_negative"],
-                            info["reviews_total"]
-                            ))
-
-            for developer in developers:
-                did = cur.execute(
-                    """
-                    SELECT id FROM developers
-                    WHERE name = ?;
-                    """, (developer,)).fetchone()[0]
-                cur.execute(
-                    """
-                    INSERT OR IGNORE INTO game_developers (appid, did)
-                    VALUES (?, ?);
-                    """, (appid, did,))
+        # Only remember ids once they are committed
+        for table_name, resolved in ids.items():
+            self._item_ids.setdefault(table_name, {}).update(resolved)
 
-            for publisher in publishers:
-                pid = cur.execute(
-                    """
-                    SELECT id FROM publishers
-                    WHERE name = ?;
-                        """, (publisher,)).fetchone()[0]
-                cur.execute(
-                    """
-                    INSERT OR IGNORE INTO game_publishers (appid, pid)
-                    VALUES (?, ?);
-                    """, (appid, pid,))
+        # Subscribers catch up with the change log from the last version
+        events.publish(events.CatalogChange(version, infos[-1]["appid"],
+                                            "insert", None))
+        return len(infos)
 
-            for tag in tags:
-                tid = cur.execute(
-                    """
-                    SELECT id FROM tags
-                    WHERE name = ?;
-                    """, (tag,)).fetchone()[0]
-                cur.execute(
-                    """
-                    INSERT OR IGNORE INTO game_tags (appid, tid)
-                    VALUES (?, ?);
-                    """, (appid, tid,))
+    def _resolve_item_ids(self, cur, table_name, names):
+        """
+        Map names of developers/publishers/tags to their ids, inserting the
+        missing ones. Known ids are kept in memory between calls.
 
-            conn.commit()
-            return 0  # success
+        Returns:
+            dict: {name: id} for every name
+        """
+        known = self._item_ids.get(table_name, {})
+        resolved = {n: known[n] for n in names if n in known}
+        missing = [n for n in names if n not in known]
+        if not missing:
+            return resolved
+
+        cur.executemany(f"""
+                        INSERT OR IGNORE INTO {table_name} (name)
+                        VALUES (?);
+                        """, [(n,) for n in missing])
+        for i in range(0, len(missing), 500):
+            chunk = missing[i:i + 500]
+            placeholders = ','.join('?' * len(chunk))
+            resolved.update(
+                (name, id) for (id, name) in cur.execute(f"""
+                    SELECT id, name FROM {table_name}
+                    WHERE name IN ({placeholders})
+                    """, tuple(chunk)))
+        return resolved
 
     def delete_game_by_appid(self, appid):
-        with sqlite3.connect(self.filename) as conn:
+        with connections.write(self.filename) as conn:
             cur = conn.cursor()
             cur.execute("DELETE FROM games WHERE appid = ?", (appid,))
+            version = self._record_change(cur, appid, "delete")
             conn.commit()
 
+        events.publish(events.CatalogChange(version, appid, "delete", None))
+
     def change_game_price(self, appid, price):
-        with sqlite3.connect(self.filename) as conn:
+        with connections.write(self.filename) as conn:
             cur = conn.cursor()
             cur.execute("UPDATE games SET price = ? WHERE appid = ?",
                         (price, appid,))
+            version = self._record_change(cur, appid, "price")
             conn.commit()
 
+        events.publish(events.CatalogChange(version, appid, "price", price))
+
+    def _record_change(self, cur, appid, op):
+        """
+        Append a write to the catalog change log, inside the caller's
+        transaction. Other processes use the log to catch up.
+
+        Returns:
+            int: Version of the change
+        """
+        cur.execute("INSERT INTO catalog_changes (appid, op) VALUES (?, ?)",
+                    (appid, op,))
+        return cur.lastrowid
+
+    def get_catalog_version(self):
+        # Version of the latest write to the games table (0 if none)
+        with connections.read(self.filename) as conn:
+            cur = conn.cursor()
+            version = cur.execute(
+                    "SELECT MAX(version) FROM catalog_changes").fetchone()[0]
+            return version or 0
+
+    def get_catalog_changes(self, since):
+        """
+        Fetch every write to the games table made after a version
+
+        Params:
+            since (int): Last version already known by the caller
+
+        Returns:
+            list[tuple]: (version, appid, op) in version order
+        """
+        with connections.read(self.filename) as conn:
+            cur = conn.cursor()
+            return cur.execute("""
+                               SELECT version, appid, op
+                               FROM catalog_changes
+                               WHERE version > ?
+                               ORDER BY version
+                               """, (since,)).fetchall()
+
     def custom_query(self, query):
-        with sqlite3.connect(self.filename) as conn:
+        with connections.read(self.filename) as conn:
             cur = conn.cursor()
             cur.execute(query)
             return cur.fetchall()
 
 
+# Every public method is timed as db.<method>
+instrumentation.time_methods(Db, "db")
+
 instance = Db(_filename)
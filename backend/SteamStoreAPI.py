@@ -1,30 +1,123 @@
+import json
+import os
 import requests
+import appdetails_cache
+import http_client
+import instrumentation
+import scheduler
 
-base_url = "https://store.steampowered.com/api/appdetails"
-base_url_steamspy = "https://steamspy.com/api.php?request=appdetails&appid="
+# Overridable to point at a local stub of both APIs
+base_url = os.getenv("STEAM_STORE_URL",
+                     "https://store.steampowered.com/api/appdetails")
+base_url_steamspy = os.getenv(
+        "STEAMSPY_URL", "https://steamspy.com/api.php?request=appdetails&appid=")
 
 
-def get_steam_app_details(appid):
-    params = {"appids": appid}
+def _fetch(endpoint, appid, url, params, priority, valid):
+    """
+    GET an appdetails answer, going through the local cache
+    (see appdetails_cache.AppDetailsCache)
 
-    res = requests.get(base_url, params=params)
-    if res.status_code != 200:
-        return None
+    A fresh cached answer is returned without a request, except to
+    INTERACTIVE callers. A stale one (or any one, for INTERACTIVE callers)
+    is revalidated with If-None-Match / If-Modified-Since, and kept if the
+    upstream answers 304. If the upstream fails (no response, or 429/5xx
+    after every retry), the cached answer is returned, however old.
 
-    return res.json()
+    Params:
+        valid (callable): Whether a parsed body is a real answer. Failures
+            (a throttled `null`, success: false...) are never cached, so
+            the next call asks again.
 
+    Returns:
+        (int, dict): HTTP status and parsed JSON body (None if invalid)
+    """
+    cache = appdetails_cache.instance
+    entry = cache.get(endpoint, appid)
+    if (entry is not None and entry["fresh"] and
+            priority != scheduler.INTERACTIVE):
+        cache.count("hits")
+        return 200, json.loads(entry["body"])
 
-def get_steam_app_details_steamspy(appid):
-    res = requests.request(method="GET", url=f"{base_url_steamspy}{appid}")
-    if res.status_code != 200:
-        return {"success": False,
-                "status": res.status_code,
-                "message": f"HTTP request failed: {res.status_code}"
-                }
+    headers = {}
+    if entry is not None:
+        if entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
 
+    try:
+        res = http_client.instance.get(url, params=params,
+                                       headers=headers or None,
+                                       endpoint=endpoint, priority=priority)
+    except requests.RequestException:
+        if entry is None:
+            raise
+        res = None
+    if entry is not None and (res is None or res.status_code in
+                              http_client.RETRY_STATUSES):
+        cache.count("stale")
+        return 200, json.loads(entry["body"])
+    if res.status_code == 304 and entry is not None:
+        cache.count("revalidated")
+        cache.refresh(endpoint, appid, entry)
+        return 200, json.loads(entry["body"])
+
+    cache.count("misses")
     try:
         data = res.json()
     except ValueError:
+        return res.status_code, None
+
+    if res.status_code == 200 and valid(data):
+        cache.put(endpoint, appid, res.text, res.headers.get("ETag"),
+                  res.headers.get("Last-Modified"))
+    return res.status_code, data
+
+
+@instrumentation.timed("steam.appdetails")
+def get_steam_app_details(appid, priority=scheduler.BACKGROUND):
+    status, data = _fetch("store", appid, base_url, {"appids": appid},
+                          priority, lambda data: _store_success(appid, data))
+    return _parse_app_details(status, data)
+
+
+def _store_success(appid, data):
+    # The store answers {"<appid>": {"success": true, "data": {...}}}
+    if not isinstance(data, dict):
+        return False
+    app = data.get(str(appid))
+    return isinstance(app, dict) and app.get("success") is True
+
+
+def _steamspy_match(appid, data):
+    # SteamSpy answers the details of the requested appid
+    return isinstance(data, dict) and str(data.get("appid")) == str(appid)
+
+
+def _parse_app_details(status, data):
+    if status != 200:
+        return None
+
+    return data
+
+
+@instrumentation.timed("steamspy.appdetails")
+def get_steam_app_details_steamspy(appid, priority=scheduler.BACKGROUND):
+    status, data = _fetch("steamspy", appid, f"{base_url_steamspy}{appid}",
+                          None, priority,
+                          lambda data: _steamspy_match(appid, data))
+    return _parse_app_details_steamspy(appid, status, data)
+
+
+def _parse_app_details_steamspy(appid, status, data):
+    if status != 200:
+        return {"success": False,
+                "status": status,
+                "message": f"HTTP request failed: {status}"
+                }
+
+    if data is None:
         return {"success": False,
                 "status": -1,
                 "message": "Empty/Invalid JSON response"
@@ -33,7 +126,7 @@ def get_steam_app_details_steamspy(appid):
     req_appid = data.get("appid", -1)
     if int(req_appid) != appid:
         return {"success": False,
-                "status": res.status_code,
+                "status": status,
                 "message": f"Different appid: Expected {appid}, got {req_appid}"
                 }
 
@@ -54,7 +147,7 @@ def get_steam_app_details_steamspy(appid):
 
     return {
             "success": True,
-            "status": res.status_code,
+            "status": status,
             "message": f"Info for {appid} fetched successfully",
             "developers": developers,
             "publishers": publishers,
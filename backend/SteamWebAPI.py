@@ -1,5 +1,7 @@
 import os
-import requests
+import http_client
+import instrumentation
+import scheduler
 
 
 class SteamWebAPI:
@@ -9,7 +11,7 @@ class SteamWebAPI:
             raise ValueError("Missing STEAM_API_KEY environment variable")
         self.url_base = "https://api.steampowered.com/"
 
-    def GetPlayerSummariesv2(self, steamid):
+    def GetPlayerSummariesv2(self, steamid, priority=scheduler.INTERACTIVE):
         """
         Get generic public information from a user's profile.
         https://developer.valvesoftware.com/wiki/Steam_Web_API#GetPlayerSummaries_(v0002)
@@ -19,6 +21,7 @@ class SteamWebAPI:
                 id (number, singular, lists do not work)
                 'id'
                 'id1, id2'
+            priority: Scheduler priority (scheduler.INTERACTIVE/BACKGROUND)
 
         Returns:
             None if request fails
@@ -31,19 +34,22 @@ class SteamWebAPI:
                 "steamids": steamid
         }
 
-        response = requests.get(url, params=params)
+        response = http_client.instance.get(url, params=params,
+                                            endpoint="webapi",
+                                            priority=priority)
         if response.status_code != 200:
             # Request failed
             return None
         return response.json()
 
-    def GetOwnedGames(self, steamid):
+    def GetOwnedGames(self, steamid, priority=scheduler.INTERACTIVE):
         """
         Get a list of appids of games the user owns + free games they've played.
         https://developer.valvesoftware.com/wiki/Steam_Web_API#GetOwnedGames_(v0001)
 
         Params:
             steamid: number or string 'id'
+            priority: Scheduler priority (scheduler.INTERACTIVE/BACKGROUND)
 
         Returns:
             None if request fails
@@ -61,7 +67,9 @@ class SteamWebAPI:
                 "include_played_free_games": True
         }
 
-        response = requests.get(url, params=params)
+        response = http_client.instance.get(url, params=params,
+                                            endpoint="webapi",
+                                            priority=priority)
         if response.status_code != 200:
             # Request failed
             print(response.status_code)
@@ -84,4 +92,7 @@ class SteamWebAPI:
         }
 
 
+# Every call is timed as steam.<method>
+instrumentation.time_methods(SteamWebAPI, "steam")
+
 instance = SteamWebAPI()
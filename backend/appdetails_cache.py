@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import zlib
+
+CACHE_DIR = os.getenv("APPDETAILS_CACHE_DIR", "appdetails_cache")
+# Answers younger than this are served without asking the upstream
+TTL = 24 * 60 * 60  # seconds
+# Total size of the compressed entries, oldest-used are evicted past it
+MAX_BYTES = 512 * 1024 * 1024
+# Eviction goes down to this fraction of MAX_BYTES
+EVICT_TO = 0.9
+
+
+class AppDetailsCache:
+    """
+    Local cache of appdetails answers, one compressed file per
+    (endpoint, appid), named after a hash of the pair.
+
+    Each entry keeps the body with the ETag / Last-Modified validators the
+    upstream sent, so a stale entry can be revalidated with a conditional
+    request instead of downloaded again. Reading an entry bumps its mtime;
+    when the cache grows past max_bytes the least recently used entries
+    are deleted.
+    """
+
+    def __init__(self, directory=CACHE_DIR, ttl=TTL, max_bytes=MAX_BYTES):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        # stale: cached answers served because the upstream failed
+        self.counters = {"hits": 0, "misses": 0, "revalidated": 0,
+                         "stale": 0, "stored": 0, "evicted": 0}
+        self._size = None  # Computed on first write
+        self._lock = threading.Lock()
+
+    def _path(self, endpoint, appid):
+        key = hashlib.sha256(f"{endpoint}:{appid}".encode()).hexdigest()
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, endpoint, appid):
+        """
+        Fetch a cached answer
+
+        Returns:
+            dict: {body, etag, last_modified, stored_at, fresh}, or None
+        """
+        path = self._path(endpoint, appid)
+        try:
+            with open(path, "rb") as f:
+                entry = json.loads(zlib.decompress(f.read()))
+            os.utime(path)
+        except (OSError, ValueError, zlib.error):
+            return None
+
+        entry["fresh"] = time.time() - entry["stored_at"] < self.ttl
+        return entry
+
+    def put(self, endpoint, appid, body, etag=None, last_modified=None):
+        """
+        Store an answer
+
+        Params:
+            body (string): Response text
+            etag, last_modified (string): Validators sent by the upstream
+        """
+        data = zlib.compress(json.dumps({
+            "body": body,
+            "etag": etag,
+            "last_modified": last_modified,
+            "stored_at": time.time(),
+        }).encode())
+
+        path = self._path(endpoint, appid)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            old_size = os.path.getsize(path)
+        except OSError:
+            old_size = 0
+
+        # Write then rename, so readers never see half a file
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+        with self._lock:
+            self.counters["stored"] += 1
+            if self._size is None:
+                self._size = self._scan()[1]
+            else:
+                self._size += len(data) - old_size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def refresh(self, endpoint, appid, entry):
+        # Mark a stale entry as valid again after a 304
+        self.put(endpoint, appid, entry["body"], entry["etag"],
+                 entry["last_modified"])
+
+    def count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        served = stats["hits"] + stats["revalidated"] + stats["stale"]
+        lookups = served + stats["misses"]
+        stats["hit_rate"] = served / lookups if lookups else 0.0
+        return stats
+
+    def _scan(self):
+        # (path, size, mtime) of every entry, and their total size
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((path, st.st_size, st.st_mtime))
+        return entries, sum(e[1] for e in entries)
+
+    def _evict(self):
+        entries, self._size = self._scan()
+        entries.sort(key=lambda e: e[2])
+        target = self.max_bytes * EVICT_TO
+        for path, size, _ in entries:
+            if self._size <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._size -= size
+            self.counters["evicted"] += 1
+
+
+instance = AppDetailsCache()
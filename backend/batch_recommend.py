@@ -0,0 +1,209 @@
+"""
+Offline batch job computing the recommendations of every synced user.
+
+The catalog is loaded once, then a pool of forked workers scores users in
+parallel. Workers only read: the catalog arrays are shared with the parent
+copy-on-write, and every result is written by the parent. A run writes a
+new generation of user_recommendations; /recommend serves the latest
+complete generation (see get_precomputed) and scores live otherwise.
+
+Usage (from backend/):
+    python batch_recommend.py [--workers N] [--top N]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import time
+
+import connections
+import profile_store
+import recommender
+
+_filename = "steam_games.db"
+
+# Games stored per user
+TOP_N = 100
+# Users written per transaction
+WRITE_BATCH = 500
+# Complete generations kept, older ones are deleted
+KEEP_GENERATIONS = 2
+
+
+def synced_users():
+    """
+    Returns:
+        list[(string, int)]: Every user with a stored library, and their
+            sync version (see user_library)
+    """
+    with connections.read(_filename) as conn:
+        cur = conn.cursor()
+        return cur.execute("""
+                           SELECT o.user_id, COALESCE(s.version, 0)
+                           FROM (SELECT DISTINCT user_id
+                                 FROM user_owned_games) AS o
+                           LEFT JOIN user_sync s ON s.user_id = o.user_id
+                           """).fetchall()
+
+
+def _recommend(args):
+    # Worker: top games of one user, without writing anything
+    steamid, sync_version, top = args
+    engine = recommender.ENGINE
+
+    games = recommender.get_user_library(steamid)
+    profile = profile_store.instance.get(
+            steamid, profile_store.library_fingerprint(
+                    games, recommender.owned_items(engine.catalog, games)))
+    if profile is None:
+        profile = recommender.build_profile(steamid, list(games),
+                                            engine.catalog)
+
+    scores = engine.score(profile)
+    rows = engine.top_k(scores, top, engine.owned_mask(list(games)))
+    results = recommender.format_results(engine.catalog, rows, scores[rows])
+    return steamid, sync_version, json.dumps(results)
+
+
+def run(workers=None, top=TOP_N):
+    """
+    Compute and store a new generation of recommendations
+
+    Params:
+        workers (int): Processes, defaults to the number of CPUs
+        top (int): Games stored per user
+
+    Returns:
+        dict: {generation, users, seconds}
+    """
+    start = time.perf_counter()
+
+    # Loaded before forking, so every worker shares the same arrays
+    recommender.ensure_cache_loaded()
+    version = recommender.GAME_CACHE.version
+    users = synced_users()
+
+    with connections.write(_filename) as conn:
+        cur = conn.cursor()
+        cur.execute("""
+                    INSERT INTO recommendation_generations
+                        (started_at, catalog_version, top)
+                    VALUES (?, ?, ?)
+                    """, (time.time(), version, top))
+        generation = cur.lastrowid
+        conn.commit()
+
+    def write(batch):
+        with connections.write(_filename) as conn:
+            conn.executemany("""
+                             INSERT OR REPLACE INTO user_recommendations
+                                 (user_id, generation, sync_version, results)
+                             VALUES (?, ?, ?, ?)
+                             """, [(steamid, generation, sync_version, results)
+                                   for steamid, sync_version, results in batch])
+            conn.commit()
+        batch.clear()
+
+    tasks = [(steamid, sync_version, top) for steamid, sync_version in users]
+    batch = []
+    context = multiprocessing.get_context("fork")
+    with context.Pool(workers or os.cpu_count()) as pool:
+        for result in pool.imap_unordered(_recommend, tasks, chunksize=16):
+            batch.append(result)
+            if len(batch) >= WRITE_BATCH:
+                write(batch)
+    write(batch)
+
+    with connections.write(_filename) as conn:
+        cur = conn.cursor()
+        cur.execute("""
+                    UPDATE recommendation_generations
+                    SET finished_at = ?, users = ?
+                    WHERE id = ?
+                    """, (time.time(), len(users), generation))
+        # Drop the generations no reader can be using anymore, and the
+        # leftovers of runs that never finished
+        old = cur.execute("""
+                          SELECT id FROM recommendation_generations
+                          WHERE finished_at IS NOT NULL
+                          ORDER BY id DESC LIMIT -1 OFFSET ?
+                          """, (KEEP_GENERATIONS,)).fetchall()
+        old += cur.execute("""
+                           SELECT id FROM recommendation_generations
+                           WHERE finished_at IS NULL AND id < ?
+                           """, (generation,)).fetchall()
+        cur.executemany("""
+                        DELETE FROM user_recommendations WHERE generation = ?
+                        """, old)
+        cur.executemany("""
+                        DELETE FROM recommendation_generations WHERE id = ?
+                        """, old)
+        conn.commit()
+
+    return {"generation": generation, "users": len(users),
+            "seconds": time.perf_counter() - start}
+
+
+def latest_generation():
+    # Id of the latest complete run, 0 if none
+    with connections.read(_filename) as conn:
+        row = conn.execute("""
+                           SELECT MAX(id) FROM recommendation_generations
+                           WHERE finished_at IS NOT NULL
+                           """).fetchone()
+    return row[0] or 0
+
+
+def get_precomputed(steamid, offset=0, limit=10):
+    """
+    A user's recommendations from the latest complete batch run
+
+    Params:
+        steamid: The user's steamid
+        offset, limit (int): Page of the stored list
+
+    Returns:
+        list[dict]: Same as recommender.recommend_for_user, or None if the
+            user has no stored list, their library was synced again or the
+            catalog changed since it was computed, or the page goes past it
+    """
+    with connections.read(_filename) as conn:
+        cur = conn.cursor()
+        row = cur.execute("""
+                          SELECT r.results, g.top
+                          FROM user_recommendations r
+                          JOIN recommendation_generations g
+                              ON g.id = r.generation
+                          LEFT JOIN user_sync s ON s.user_id = r.user_id
+                          WHERE r.user_id = ?
+                            AND r.generation = (
+                                SELECT MAX(id) FROM recommendation_generations
+                                WHERE finished_at IS NOT NULL)
+                            AND r.sync_version = COALESCE(s.version, 0)
+                            AND g.catalog_version = (
+                                SELECT COALESCE(MAX(version), 0)
+                                FROM catalog_changes)
+                          """, (str(steamid),)).fetchone()
+    if row is None:
+        return None
+
+    results, top = json.loads(row[0]), row[1]
+    if offset + limit > len(results) and len(results) >= top:
+        return None  # The stored list is too short for this page
+    return results[offset:offset + limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+            description="Precompute the recommendations of every synced user")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--top", type=int, default=TOP_N)
+    args = parser.parse_args()
+
+    stats = run(args.workers, args.top)
+    print(f"Generation {stats['generation']}: {stats['users']} users "
+          f"in {stats['seconds']:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
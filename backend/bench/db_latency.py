@@ -0,0 +1,81 @@
+"""
+Per-call latency of Db methods with a fresh connection per call (how Db
+used to work) and with pooled connections.
+
+Usage (from backend/): python -m bench.db_latency [games]
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+import connections
+import Db
+from bench.synthetic import make_db
+
+CALLS = 2000
+
+
+class FreshConnections:
+    # Stand-in ConnectionManager that connects on every call
+    def __init__(self, filename):
+        self.filename = filename
+
+    @contextmanager
+    def read(self):
+        with sqlite3.connect(self.filename) as conn:
+            yield conn
+
+    write = read
+
+    def close(self):
+        pass
+
+
+def per_call(fn, args):
+    start = time.perf_counter()
+    for a in args:
+        fn(a)
+    return (time.perf_counter() - start) / len(args)
+
+
+def main():
+    games = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, "steam_games.db")
+        appids = make_db(filename, games=games)
+        db = Db.Db(filename)
+        sample = appids[::max(1, len(appids) // CALLS)][:CALLS]
+
+        cases = [
+            ("get_app_details", db.get_app_details, sample),
+            ("get_app_details_many(500)", db.get_app_details_many,
+             [sample[i:i + 500] for i in range(0, len(sample), 500)]),
+            ("query_game_by_appid", db.query_game_by_appid, sample),
+            ("query_relation_by_appid",
+             lambda a: db.query_relation_by_appid("game_tags", a), sample),
+            ("change_game_price",
+             lambda a: db.change_game_price(a, 999), sample[:200]),
+        ]
+
+        print(f"{games} games, {len(sample)} calls per read method")
+        print(f"{'method':>26} {'fresh':>10} {'pooled':>10} {'speedup':>8}")
+        for name, fn, args in cases:
+            connections._managers[filename] = FreshConnections(filename)
+            fresh = per_call(fn, args)
+
+            connections._managers[filename] = \
+                connections.ConnectionManager(filename)
+            fn(args[0])  # warm up
+            pooled = per_call(fn, args)
+            connections.get(filename).close()
+
+            print(f"{name:>26} {fresh * 1e6:>8.0f}us {pooled * 1e6:>8.0f}us "
+                  f"{fresh / pooled:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Ingestion throughput against the local Steam stub.
+
+Compares Db.insert_game_by_appid in a loop with ingest.ingest_apps, with
+an empty appdetails cache, then a rebuild served by a warm cache.
+
+Usage (from backend/): python -m bench.ingest_throughput [apps] [latency_ms]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import Db
+import SteamStoreAPI as ssa
+import appdetails_cache
+import ingest
+import scheduler
+from bench import steam_stub
+from bench.synthetic import make_db
+
+
+def main():
+    apps = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.02
+
+    server, ssa.base_url, ssa.base_url_steamspy = \
+        steam_stub.start(latency=latency)
+    # The stub has no rate limit
+    for endpoint in ("store", "steamspy"):
+        scheduler.instance.set_limit(endpoint, 100000, 1000)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, "steam_games.db")
+        make_db(filename, games=0)
+        db = Db.Db(filename)
+        appids = list(range(100000, 100000 + apps))
+
+        appdetails_cache.instance = appdetails_cache.AppDetailsCache(
+                os.path.join(tmp, "cache-sample"))
+        sample = appids[:max(1, apps // 20)]
+        start = time.perf_counter()
+        for appid in sample:
+            db.insert_game_by_appid(appid)
+        one_by_one = len(sample) / (time.perf_counter() - start)
+        print(f"insert_game_by_appid: {one_by_one:.1f} apps/s "
+              f"({len(sample)} apps, {latency * 1000:.0f}ms upstream latency)")
+
+        for workers in (1, 8, 32):
+            appdetails_cache.instance = appdetails_cache.AppDetailsCache(
+                    os.path.join(tmp, f"cache-{workers}"))
+            stats = ingest.ingest_apps(appids, workers=workers, db=db)
+            print(f"ingest_apps, {workers:>2} workers: "
+                  f"{stats['apps_per_second']:.1f} apps/s "
+                  f"({stats['inserted']} inserted, {stats['skipped']})")
+
+        # Same apps again, answered from the last cache
+        requests = steam_stub.StubHandler.requests
+        stats = ingest.ingest_apps(appids, workers=8, db=db)
+        cache = appdetails_cache.instance.stats()
+        print(f"rebuild, warm cache:  {stats['apps_per_second']:.1f} apps/s "
+              f"({cache['hits']} hits, {cache['misses']} misses, "
+              f"{steam_stub.StubHandler.requests - requests} upstream requests)")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
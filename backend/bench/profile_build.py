@@ -0,0 +1,81 @@
+"""
+Profile build time against library size.
+
+Compares the old build_profile (one get_app_details join per owned game)
+with the catalog-based one.
+
+Usage (from backend/): python -m bench.profile_build [games]
+"""
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import Db
+import recommender
+from bench.synthetic import make_db, add_user
+
+LIBRARY_SIZES = [10, 100, 1000, 3000, 10000]
+
+
+def build_profile_per_game(steamid):
+    # build_profile as it was: one connection and one join per owned game
+    cat_counter = Counter()
+    tag_counter = Counter()
+
+    for appid in recommender.get_user_owned(steamid):
+        g = Db.instance.get_app_details(appid)
+        if not g:
+            continue
+
+        cat_counter.update(g["categories"])
+        tag_counter.update(g["tags"])
+
+    total_cat = sum(cat_counter.values()) or 1
+    total_tag = sum(tag_counter.values()) or 1
+
+    return {
+        "categories": {k: v / total_cat for k, v in cat_counter.items()},
+        "tags": {k: v / total_tag for k, v in tag_counter.items()},
+    }
+
+
+def timed(fn, *args, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    games = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, "steam_games.db")
+        appids = make_db(filename, games=games)
+        Db.instance.filename = filename
+        recommender.DB_FILE = filename
+        recommender.ensure_cache_loaded()
+
+        print(f"{games} games in catalog")
+        print(f"{'library':>8} {'per-game':>12} {'catalog':>12} {'speedup':>8}")
+        for size in LIBRARY_SIZES:
+            if size > len(appids):
+                break
+            steamid = f"bench{size}"
+            add_user(filename, steamid, appids[:size])
+
+            old, old_profile = timed(build_profile_per_game, steamid)
+            new, new_profile = timed(recommender.build_profile, steamid)
+            assert old_profile == new_profile
+
+            print(f"{size:>8} {old * 1000:>10.1f}ms {new * 1000:>10.2f}ms "
+                  f"{old / new:>7.0f}x")
+
+
+if __name__ == "__main__":
+    main()
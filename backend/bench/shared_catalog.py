@@ -0,0 +1,97 @@
+"""
+Memory of N worker processes holding the catalog: every worker loading its
+own copy from the database, against every worker mapping one shared
+segment (catalog_segment).
+
+Reports per worker:
+    uss: memory only this worker uses (private pages)
+    pss: its share of the memory, shared pages split between their users
+The sum of pss is what the workers take together.
+
+Usage (from backend/): python -m bench.shared_catalog [games] [workers]
+"""
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+
+from catalog import Catalog
+from catalog_segment import SegmentStore
+from scoring import ScoringEngine
+from bench.synthetic import make_db
+
+
+def rollup(pid):
+    # {field: kB} of /proc/<pid>/smaps_rollup
+    out = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                out[parts[0].rstrip(":")] = int(parts[1])
+    return out
+
+
+def worker(mode, source, barrier, results):
+    if mode == "private":
+        with sqlite3.connect(source) as conn:
+            catalog = Catalog.load(conn)
+    else:
+        catalog = Catalog.open(source)
+    engine = ScoringEngine(catalog)
+
+    # Serve one request so every page the scoring path reads is resident
+    profile = {"tags": {catalog.tags.names[c]: 1.0
+                        for c in range(0, len(catalog.tags), 7)},
+               "categories": {}}
+    engine.top_k(engine.score(profile), 10)
+    catalog[len(catalog) // 2]
+
+    barrier.wait()  # Every worker is loaded: measure them together
+    r = rollup(os.getpid())
+    results.put((r["Pss"], r["Private_Clean"] + r["Private_Dirty"]))
+    barrier.wait()
+
+
+def measure(mode, source, workers):
+    context = multiprocessing.get_context("fork")
+    barrier = context.Barrier(workers)
+    results = context.Queue()
+    procs = [context.Process(target=worker,
+                             args=(mode, source, barrier, results))
+             for _ in range(workers)]
+    for p in procs:
+        p.start()
+    out = [results.get() for _ in procs]
+    for p in procs:
+        p.join()
+
+    pss = sum(r[0] for r in out) / 1024
+    uss = sum(r[1] for r in out) / len(out) / 1024
+    print(f"{mode:>8}, {workers} workers: total pss {pss:7.1f} MiB, "
+          f"uss {uss:6.1f} MiB per worker")
+
+
+def main():
+    games = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, "steam_games.db")
+        make_db(filename, games=games)
+
+        with sqlite3.connect(filename) as conn:
+            catalog = Catalog.load(conn)
+        store = SegmentStore(os.path.join(tmp, "segments"))
+        segment = os.path.join(store.directory, store.publish(catalog))
+        del catalog
+
+        print(f"{games} games")
+        for n in (1, workers):
+            measure("private", filename, n)
+            measure("shared", segment, n)
+
+
+if __name__ == "__main__":
+    main()
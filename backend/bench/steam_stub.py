@@ -0,0 +1,129 @@
+"""
+Local HTTP stub of the Steam store and SteamSpy appdetails endpoints.
+
+Answers are made up but deterministic for a given appid:
+    appid % 10 == 0: the app does not exist
+    appid % 10 == 1: the app is DLC
+    anything else: a game with tags, developers and publishers
+
+Answers carry an ETag, and a matching If-None-Match gets a 304.
+
+Usage (from backend/):
+    python -m bench.steam_stub [port] [latency_ms]
+
+then point SteamStoreAPI at it:
+    STEAM_STORE_URL=http://127.0.0.1:PORT/api/appdetails
+    STEAMSPY_URL=http://127.0.0.1:PORT/api.php?request=appdetails&appid=
+"""
+import hashlib
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+def store_details(appid):
+    if appid % 10 == 0:
+        return {str(appid): {"success": False}}
+
+    rng = random.Random(appid)
+    return {str(appid): {"success": True, "data": {
+        "type": "dlc" if appid % 10 == 1 else "game",
+        "name": f"Stub Game {appid}",
+        "controller_support": rng.choice(["full", "partial", None]),
+        "achievements": {"total": rng.randint(0, 50)},
+        "platforms": {"windows": True, "mac": rng.random() < 0.3,
+                      "linux": rng.random() < 0.2},
+        "price_overview": {"initial": rng.choice([0, 499, 999, 1999])},
+        "recommendations": {"total": rng.randint(0, 10000)},
+        "release_date": {"date": "1 Jan, 2020"},
+        "header_image": f"https://example.com/{appid}.jpg",
+    }}}
+
+
+def steamspy_details(appid):
+    rng = random.Random(-appid)
+    tags = rng.sample(range(1, 400), rng.randint(1, 20))
+    return {
+        "appid": appid,
+        "developer": f"Stub Developer {rng.randint(1, 2000)}",
+        "publisher": f"Stub Publisher {rng.randint(1, 1000)}",
+        "positive": rng.randint(0, 5000),
+        "negative": rng.randint(0, 500),
+        "tags": {f"Tag {t}": rng.randint(1, 1000) for t in tags},
+    }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # Keep-alive, like the real endpoints
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    latency = 0.0
+    requests = 0
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        time.sleep(self.latency)
+        StubHandler.requests += 1
+
+        if url.path.endswith("/appdetails") and "appids" in query:
+            body = store_details(int(query["appids"][0]))
+        elif url.path.endswith("/api.php") and "appid" in query:
+            body = steamspy_details(int(query["appid"][0]))
+        else:
+            self.send_error(404)
+            return
+
+        data = json.dumps(body).encode()
+        etag = '"%s"' % hashlib.sha1(data).hexdigest()
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start(port=0, latency=0.0):
+    """
+    Run the stub in a background thread
+
+    Params:
+        port (int): Port to listen on, 0 picks a free one
+        latency (float): Seconds to wait before every answer
+
+    Returns:
+        (ThreadingHTTPServer, string, string): The server, then the store
+            and SteamSpy URLs to use
+    """
+    StubHandler.latency = latency
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    return (server, f"{base}/api/appdetails",
+            f"{base}/api.php?request=appdetails&appid=")
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8000
+    latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.0
+    server, store_url, steamspy_url = start(port, latency)
+    print(f"STEAM_STORE_URL={store_url}")
+    print(f"STEAMSPY_URL={steamspy_url}")
+    threading.Event().wait()
@@ -0,0 +1,162 @@
+"""
+Synthetic steam_games.db for benchmarks.
+
+The schema follows docs/DB Schema.md. Names and ids are made up, but the
+shape (tags per game, categories per game, review counts) is close to the
+real catalog.
+"""
+import random
+import sqlite3
+
+SCHEMA = """
+CREATE TABLE games (
+    appid INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    controller_support INTEGER,
+    has_achievements BOOLEAN,
+    supports_windows BOOLEAN,
+    supports_mac BOOLEAN,
+    supports_linux BOOLEAN,
+    price REAL,
+    release_date DATETIME,
+    header_image TEXT,
+    positive_reviews INTEGER,
+    negative_reviews INTEGER,
+    total_reviews INTEGER
+);
+CREATE TABLE categories (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL);
+CREATE TABLE game_categories (
+    appid INTEGER NOT NULL REFERENCES games(appid),
+    cid INTEGER NOT NULL REFERENCES categories(id),
+    PRIMARY KEY (appid, cid)
+);
+CREATE TABLE tags (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT UNIQUE NOT NULL
+);
+CREATE TABLE game_tags (
+    appid INTEGER NOT NULL REFERENCES games(appid),
+    tid INTEGER NOT NULL REFERENCES tags(id),
+    PRIMARY KEY (appid, tid)
+);
+CREATE TABLE developers (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT UNIQUE NOT NULL
+);
+CREATE TABLE game_developers (
+    appid INTEGER NOT NULL REFERENCES games(appid),
+    did INTEGER NOT NULL REFERENCES developers(id),
+    PRIMARY KEY (appid, did)
+);
+CREATE TABLE publishers (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT UNIQUE NOT NULL
+);
+CREATE TABLE game_publishers (
+    appid INTEGER NOT NULL REFERENCES games(appid),
+    pid INTEGER NOT NULL REFERENCES publishers(id),
+    PRIMARY KEY (appid, pid)
+);
+CREATE TABLE user_owned_games (
+    user_id TEXT NOT NULL,
+    appid INTEGER NOT NULL,
+    playtime INTEGER DEFAULT 0,
+    PRIMARY KEY (user_id, appid)
+);
+"""
+
+WORDS = ["Quest", "Legends", "Tactics", "Odyssey", "Simulator", "Dungeon",
+         "Star", "Farm", "Racing", "Shadow", "Empire", "Island", "Knight"]
+
+
+def make_db(filename, games=20000, tags=450, categories=60,
+            developers=5000, publishers=3000, seed=0):
+    """
+    Create a synthetic games database
+
+    Params:
+        filename (string): Path of the database, overwritten if it exists
+        games (int): Number of games
+        seed (int): Random seed, the same seed gives the same database
+
+    Returns:
+        list[int]: appids of every game
+    """
+    rng = random.Random(seed)
+
+    with sqlite3.connect(filename) as conn:
+        for (table,) in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' "
+                "AND name NOT LIKE 'sqlite_%'").fetchall():
+            conn.execute(f"DROP TABLE {table}")
+        conn.executescript(SCHEMA)
+
+        conn.executemany("INSERT INTO tags (id, name) VALUES (?, ?)",
+                         [(i, f"Tag {i}") for i in range(1, tags + 1)])
+        conn.executemany("INSERT INTO categories (id, name) VALUES (?, ?)",
+                         [(i, f"Category {i}")
+                          for i in range(1, categories + 1)])
+        conn.executemany("INSERT INTO developers (id, name) VALUES (?, ?)",
+                         [(i, f"Developer {i}")
+                          for i in range(1, developers + 1)])
+        conn.executemany("INSERT INTO publishers (id, name) VALUES (?, ?)",
+                         [(i, f"Publisher {i}")
+                          for i in range(1, publishers + 1)])
+
+        appids = sorted(rng.sample(range(10, games * 50), games))
+        rows, game_tags, game_categories, game_devs, game_pubs = \
+            [], [], [], [], []
+        for appid in appids:
+            positive = int(rng.paretovariate(1.2) * 20)
+            negative = int(positive * rng.random() * 0.4)
+            rows.append((
+                appid,
+                f"{rng.choice(WORDS)} {rng.choice(WORDS)} {appid}",
+                rng.randint(0, 3),
+                rng.random() < 0.6,
+                True,
+                rng.random() < 0.3,
+                rng.random() < 0.2,
+                rng.choice([0, 199, 499, 999, 1499, 1999, 2999, 5999]),
+                "1 Jan, 2020",
+                f"https://example.com/{appid}.jpg",
+                positive,
+                negative,
+                positive + negative,
+            ))
+            for tid in rng.sample(range(1, tags + 1), rng.randint(0, 20)):
+                game_tags.append((appid, tid))
+            for cid in rng.sample(range(1, categories + 1), rng.randint(0, 8)):
+                game_categories.append((appid, cid))
+            game_devs.append((appid, rng.randint(1, developers)))
+            game_pubs.append((appid, rng.randint(1, publishers)))
+
+        conn.executemany(
+                "INSERT INTO games VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows)
+        conn.executemany("INSERT INTO game_tags VALUES (?, ?)", game_tags)
+        conn.executemany("INSERT INTO game_categories VALUES (?, ?)",
+                         game_categories)
+        conn.executemany("INSERT INTO game_developers VALUES (?, ?)",
+                         game_devs)
+        conn.executemany("INSERT INTO game_publishers VALUES (?, ?)",
+                         game_pubs)
+        conn.commit()
+
+    return appids
+
+
+def add_user(filename, steamid, appids, seed=0):
+    """
+    Give a user a library made of the given appids, with random playtimes
+    """
+    rng = random.Random(seed)
+    with sqlite3.connect(filename) as conn:
+        conn.execute("DELETE FROM user_owned_games WHERE user_id = ?",
+                     (str(steamid),))
+        conn.executemany(
+                "INSERT INTO user_owned_games (user_id, appid, playtime) "
+                "VALUES (?, ?, ?)",
+                [(str(steamid), appid, int(rng.expovariate(1 / 600)))
+                 for appid in appids])
+        conn.commit()
@@ -0,0 +1,513 @@
+import json
+import os
+import sqlite3
+import sys
+from itertools import chain
+import numpy as np
+
+
+# =========================================================
+# BUILDING BLOCKS
+# =========================================================
+
+def _csr_delete(indptr, data, rows):
+    # Drop the given rows from CSR arrays
+    lengths = np.diff(indptr)
+    keep = np.ones(len(lengths), dtype=bool)
+    keep[rows] = False
+
+    new_indptr = np.zeros(np.count_nonzero(keep) + 1, dtype=indptr.dtype)
+    np.cumsum(lengths[keep], out=new_indptr[1:])
+    return new_indptr, data[np.repeat(keep, lengths)]
+
+
+def _csr_insert(indptr, data, positions, other_indptr, other_data):
+    # Insert the rows of another CSR matrix before the given row positions
+    other_lengths = np.diff(other_indptr)
+    lengths = np.insert(np.diff(indptr), positions, other_lengths)
+
+    new_indptr = np.zeros(len(lengths) + 1, dtype=indptr.dtype)
+    np.cumsum(lengths, out=new_indptr[1:])
+    new_data = np.insert(data, np.repeat(indptr[positions], other_lengths),
+                         other_data)
+    return new_indptr, new_data
+
+
+class StringTable:
+    """
+    Many strings stored as one UTF-8 buffer plus an offset array.
+    String i is data[offsets[i]:offsets[i+1]].
+    """
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    @classmethod
+    def from_strings(cls, strings):
+        encoded = [(s or "").encode("utf-8") for s in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(e) for e in encoded], out=offsets[1:])
+        data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return cls(data, offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.data[start:end].tobytes().decode("utf-8")
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + self.offsets.nbytes
+
+    def deleted(self, rows):
+        offsets, data = _csr_delete(self.offsets, self.data, rows)
+        return StringTable(data, offsets)
+
+    def inserted(self, positions, other):
+        offsets, data = _csr_insert(self.offsets, self.data, positions,
+                                    other.offsets, other.data)
+        return StringTable(data, offsets)
+
+
+class CsrIndex:
+    """
+    Game x item incidence matrix (items being tags or categories) in CSR form.
+
+    Items are interned: column c stands for the item with database id ids[c]
+    and name names[c]. The columns of game i are
+    indices[indptr[i]:indptr[i+1]].
+    """
+
+    def __init__(self, indptr, indices, ids, names, rows=None):
+        self.indptr = indptr
+        self.indices = indices
+        self.ids = ids
+        self.names = names
+        self.columns = {names[c]: c for c in range(len(names))}
+        self._rows = rows  # row_ids(), when stored with a catalog segment
+
+    @classmethod
+    def from_pairs(cls, appids, pair_appids, pair_ids, vocab):
+        """
+        Params:
+            appids (np.ndarray): Sorted appids of the catalog (one per row)
+            pair_appids, pair_ids (np.ndarray):
+                (appid, item id) pairs sorted by appid
+            vocab (list[tuple]): (id, name) of every item
+        """
+        ids = np.array([v[0] for v in vocab], dtype=np.int64)
+        order = np.argsort(ids)
+        ids = ids[order]
+        names = StringTable.from_strings([vocab[i][1] for i in order])
+
+        rows = np.searchsorted(appids, pair_appids)
+        cols = np.searchsorted(ids, pair_ids)
+        valid = ((rows < len(appids)) & (cols < len(ids)))
+        valid[valid] &= ((appids[rows[valid]] == pair_appids[valid]) &
+                         (ids[cols[valid]] == pair_ids[valid]))
+        rows, cols = rows[valid], cols[valid]
+
+        indptr = np.zeros(len(appids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(appids)), out=indptr[1:])
+        return cls(indptr, cols.astype(np.int32), ids, names)
+
+    def __len__(self):
+        # Number of items in the vocabulary
+        return len(self.ids)
+
+    def row(self, i):
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def row_names(self, i):
+        return [self.names[c] for c in self.row(i)]
+
+    def _entries(self, rows):
+        # Position in `indices` of every entry of the given rows, and the
+        # length of each row
+        rows = np.asarray(rows, dtype=np.int64)
+        starts = self.indptr[rows]
+        lengths = self.indptr[rows + 1] - starts
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        return offsets + np.arange(lengths.sum()), lengths
+
+    def counts(self, rows, weights=None):
+        """
+        Number of the given games having each item
+
+        Params:
+            rows (np.ndarray[int]): Catalog row numbers
+            weights (np.ndarray[float]): Weight of each row, counts are
+                summed weights if given
+
+        Returns:
+            np.ndarray: One count per vocabulary column
+        """
+        entries, lengths = self._entries(rows)
+        if weights is not None:
+            weights = np.repeat(np.asarray(weights, dtype=np.float64), lengths)
+        return np.bincount(self.indices[entries], weights=weights,
+                           minlength=len(self))
+
+    def take(self, rows):
+        # Index of the given rows only, over the same vocabulary
+        entries, lengths = self._entries(rows)
+        indptr = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        return CsrIndex(indptr, self.indices[entries], self.ids, self.names)
+
+    def row_ids(self):
+        # Catalog row number of every stored entry
+        if self._rows is not None:
+            return self._rows
+        return np.repeat(np.arange(len(self.indptr) - 1, dtype=np.int32),
+                         np.diff(self.indptr))
+
+    @property
+    def nbytes(self):
+        return (self.indptr.nbytes + self.indices.nbytes +
+                self.ids.nbytes + self.names.nbytes)
+
+    def deleted(self, rows):
+        indptr, indices = _csr_delete(self.indptr, self.indices, rows)
+        return CsrIndex(indptr, indices, self.ids, self.names)
+
+    def inserted(self, positions, other):
+        """
+        Insert the rows of another index before the given row positions.
+        The vocabularies are merged if the other index knows new items.
+        """
+        ids, names = self.ids, self.names
+        indices, other_indices = self.indices, other.indices
+
+        if not np.array_equal(ids, other.ids):
+            vocab = {int(i): names[c] for c, i in enumerate(ids)}
+            vocab.update({int(i): other.names[c]
+                          for c, i in enumerate(other.ids)})
+            ids = np.array(sorted(vocab), dtype=np.int64)
+            names = StringTable.from_strings([vocab[i] for i in ids.tolist()])
+            indices = np.searchsorted(ids, self.ids)[indices]
+            other_indices = np.searchsorted(ids, other.ids)[other_indices]
+
+        indptr, indices = _csr_insert(self.indptr, indices, positions,
+                                      other.indptr, other_indices)
+        return CsrIndex(indptr, indices.astype(np.int32), ids, names)
+
+
+# =========================================================
+# CATALOG
+# =========================================================
+
+# Bits of Catalog.platforms
+PLATFORMS = {"windows": 1, "mac": 2, "linux": 4}
+# games.controller_support values, NULL is stored as unknown
+CONTROLLER_SUPPORT = {"none": 0, "partial": 1, "full": 2, "unknown": 3}
+
+class Catalog:
+    """
+    Columnar in-memory copy of the games the recommender works with.
+
+    Every game is a row number; its columns live in typed arrays instead of
+    one dict per game. Indexing (catalog[i]) and get(appid) still return
+    the dict shape the old GAME_CACHE entries had.
+
+    A catalog is never modified in place: patched() and with_price() return
+    a new catalog, so readers holding the old one stay consistent.
+    `version` is the last catalog_changes version the catalog reflects.
+    """
+
+    # Layout of the files written by save(), changed with the columns
+    FORMAT = 2
+
+    def __init__(self, appids, names, prices, positive_reviews,
+                 negative_reviews, total_reviews, platforms,
+                 controller_support, categories, tags, version=0):
+        self.appids = appids
+        self.names = names
+        self.prices = prices
+        self.positive_reviews = positive_reviews
+        self.negative_reviews = negative_reviews
+        self.total_reviews = total_reviews
+        self.platforms = platforms  # PLATFORMS bits
+        self.controller_support = controller_support
+        self.categories = categories
+        self.tags = tags
+        self.version = version
+
+    @classmethod
+    def load(cls, conn, appids=None, version=0):
+        """
+        Read the catalog from the database
+
+        Params:
+            conn (sqlite3.Connection): Open connection to the games database
+            appids (iterable[int]): Only load these games (default: all)
+            version (int): Change log version the database is at.
+                Read it BEFORE loading so that no change is missed.
+
+        Returns:
+            Catalog: Games sorted by appid
+        """
+        where, params = "", ()
+        if appids is not None:
+            where = "WHERE appid IN (SELECT value FROM json_each(?))"
+            params = (json.dumps([int(a) for a in appids]),)
+
+        games = conn.execute(f"""
+            SELECT appid, name, price, positive_reviews, negative_reviews,
+                   total_reviews, supports_windows, supports_mac,
+                   supports_linux, controller_support
+            FROM games
+            {where}
+            ORDER BY appid;
+        """, params).fetchall()
+
+        appids = np.array([g[0] for g in games], dtype=np.int64)
+        prices = np.array([np.nan if g[2] is None else g[2] for g in games],
+                          dtype=np.float64)
+        positive = np.array([g[3] or 0 for g in games], dtype=np.int32)
+        negative = np.array([g[4] or 0 for g in games], dtype=np.int32)
+        total = np.array([g[5] or 0 for g in games], dtype=np.int32)
+        platforms = np.array([bool(g[6]) * PLATFORMS["windows"] |
+                              bool(g[7]) * PLATFORMS["mac"] |
+                              bool(g[8]) * PLATFORMS["linux"]
+                              for g in games], dtype=np.uint8)
+        controller = np.array([CONTROLLER_SUPPORT["unknown"] if g[9] is None
+                               else g[9] for g in games], dtype=np.int8)
+        names = StringTable.from_strings([g[1] for g in games])
+        del games
+
+        categories = cls._load_index(conn, appids, where, params,
+                                     "game_categories", "cid", "categories")
+        tags = cls._load_index(conn, appids, where, params,
+                               "game_tags", "tid", "tags")
+
+        return cls(appids, names, prices, positive, negative, total,
+                   platforms, controller, categories, tags, version)
+
+    @staticmethod
+    def _load_index(conn, appids, where, params, relation, idname,
+                    table_name):
+        vocab = conn.execute(f"SELECT id, name FROM {table_name}").fetchall()
+        cur = conn.execute(f"""
+            SELECT appid, {idname} FROM {relation}
+            {where}
+            ORDER BY appid, {idname};
+        """, params)
+        pairs = np.fromiter(chain.from_iterable(cur),
+                            dtype=np.int64).reshape(-1, 2)
+        return CsrIndex.from_pairs(appids, pairs[:, 0], pairs[:, 1], vocab)
+
+    def __len__(self):
+        return len(self.appids)
+
+    def __getitem__(self, i):
+        price = self.prices[i]
+        return {
+            "appid": int(self.appids[i]),
+            "name": self.names[i],
+            "price": None if np.isnan(price) else float(price),
+            "positive_reviews": int(self.positive_reviews[i]),
+            "negative_reviews": int(self.negative_reviews[i]),
+            "categories": self.categories.row_names(i),
+            "tags": self.tags.row_names(i),
+        }
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def row_of(self, appid):
+        # Row number of an appid, or None if it is not in the catalog
+        i = np.searchsorted(self.appids, appid)
+        if i < len(self.appids) and self.appids[i] == appid:
+            return int(i)
+        return None
+
+    def rows_of(self, appids):
+        # Row numbers of every appid in the catalog, in catalog order
+        appids = np.unique(np.fromiter(appids, dtype=np.int64))
+        rows = np.searchsorted(self.appids, appids)
+        found = rows < len(self.appids)
+        found[found] = self.appids[rows[found]] == appids[found]
+        return rows[found]
+
+    def get(self, appid):
+        i = self.row_of(appid)
+        return None if i is None else self[i]
+
+    def patched(self, conn, appids, version):
+        """
+        Re-read some games from the database and patch them in.
+        Games that no longer exist are dropped.
+
+        Params:
+            conn (sqlite3.Connection): Open connection to the games database
+            appids (iterable[int]): Games that changed
+            version (int): Change log version the result reflects
+
+        Returns:
+            Catalog: The patched copy
+        """
+        appids = list(appids)
+        fresh = Catalog.load(conn, appids)
+        rows = self.rows_of(appids)
+
+        base = Catalog(
+                np.delete(self.appids, rows),
+                self.names.deleted(rows),
+                np.delete(self.prices, rows),
+                np.delete(self.positive_reviews, rows),
+                np.delete(self.negative_reviews, rows),
+                np.delete(self.total_reviews, rows),
+                np.delete(self.platforms, rows),
+                np.delete(self.controller_support, rows),
+                self.categories.deleted(rows),
+                self.tags.deleted(rows))
+
+        pos = np.searchsorted(base.appids, fresh.appids)
+        return Catalog(
+                np.insert(base.appids, pos, fresh.appids),
+                base.names.inserted(pos, fresh.names),
+                np.insert(base.prices, pos, fresh.prices),
+                np.insert(base.positive_reviews, pos, fresh.positive_reviews),
+                np.insert(base.negative_reviews, pos, fresh.negative_reviews),
+                np.insert(base.total_reviews, pos, fresh.total_reviews),
+                np.insert(base.platforms, pos, fresh.platforms),
+                np.insert(base.controller_support, pos,
+                          fresh.controller_support),
+                base.categories.inserted(pos, fresh.categories),
+                base.tags.inserted(pos, fresh.tags),
+                version)
+
+    def with_price(self, appid, price, version):
+        # Copy of the catalog with one price changed
+        i = self.row_of(appid)
+        prices = self.prices.copy()
+        if i is not None:
+            prices[i] = price
+        return Catalog(self.appids, self.names, prices,
+                       self.positive_reviews, self.negative_reviews,
+                       self.total_reviews, self.platforms,
+                       self.controller_support, self.categories, self.tags,
+                       version)
+
+    def save(self, directory):
+        """
+        Write every column as a .npy file in a new directory, to be mapped
+        with Catalog.open. Derived arrays the scoring engine needs are
+        stored too, so that processes mapping the files do not rebuild them.
+        """
+        os.makedirs(directory)
+        for name, array in self._arrays().items():
+            np.save(os.path.join(directory, f"{name}.npy"), array)
+        with open(os.path.join(directory, "meta.json"), "w") as f:
+            json.dump({"version": self.version, "games": len(self),
+                       "format": self.FORMAT}, f)
+
+    def _arrays(self):
+        arrays = {
+            "appids": self.appids,
+            "names.data": self.names.data,
+            "names.offsets": self.names.offsets,
+            "prices": self.prices,
+            "positive_reviews": self.positive_reviews,
+            "negative_reviews": self.negative_reviews,
+            "total_reviews": self.total_reviews,
+            "platforms": self.platforms,
+            "controller_support": self.controller_support,
+        }
+        for prefix, index in (("categories", self.categories),
+                              ("tags", self.tags)):
+            arrays.update({
+                f"{prefix}.indptr": index.indptr,
+                f"{prefix}.indices": index.indices,
+                f"{prefix}.ids": index.ids,
+                f"{prefix}.names.data": index.names.data,
+                f"{prefix}.names.offsets": index.names.offsets,
+                f"{prefix}.rows": index.row_ids(),
+            })
+        return arrays
+
+    @staticmethod
+    def format_of(directory):
+        # Layout version of a directory written by save()
+        with open(os.path.join(directory, "meta.json")) as f:
+            return json.load(f).get("format", 1)
+
+    @classmethod
+    def open(cls, directory):
+        """
+        Map a catalog written by save(). The arrays are read-only views of
+        the files: every process opening the same directory shares their
+        pages instead of holding its own copy.
+        """
+        def load(name):
+            return np.load(os.path.join(directory, f"{name}.npy"),
+                           mmap_mode="r")
+
+        def index(prefix):
+            names = StringTable(load(f"{prefix}.names.data"),
+                                load(f"{prefix}.names.offsets"))
+            return CsrIndex(load(f"{prefix}.indptr"),
+                            load(f"{prefix}.indices"),
+                            load(f"{prefix}.ids"), names,
+                            load(f"{prefix}.rows"))
+
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+
+        return cls(load("appids"),
+                   StringTable(load("names.data"), load("names.offsets")),
+                   load("prices"), load("positive_reviews"),
+                   load("negative_reviews"), load("total_reviews"),
+                   load("platforms"), load("controller_support"),
+                   index("categories"), index("tags"), meta["version"])
+
+    def memory_report(self):
+        """
+        Bytes held by every column of the catalog
+
+        Returns:
+            dict: {column: bytes}, plus "total"
+        """
+        report = {
+            "appids": self.appids.nbytes,
+            "names": self.names.nbytes,
+            "prices": self.prices.nbytes,
+            "reviews": (self.positive_reviews.nbytes +
+                        self.negative_reviews.nbytes +
+                        self.total_reviews.nbytes),
+            "features": (self.platforms.nbytes +
+                         self.controller_support.nbytes),
+            "categories": self.categories.nbytes,
+            "tags": self.tags.nbytes,
+            # name -> column lookups of the two vocabularies
+            "lookups": sum(sys.getsizeof(index.columns) +
+                           sum(sys.getsizeof(k) for k in index.columns)
+                           for index in (self.categories, self.tags)),
+        }
+        report["total"] = sum(report.values())
+        return report
+
+
+if __name__ == "__main__":
+    # Usage: python catalog.py [database]
+    # Loads the catalog and prints how much memory it takes
+    import tracemalloc
+
+    filename = sys.argv[1] if len(sys.argv) > 1 else "steam_games.db"
+    with sqlite3.connect(filename) as conn:
+        tracemalloc.start()
+        catalog = Catalog.load(conn)
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    print(f"{len(catalog)} games, {len(catalog.tags)} tags, "
+          f"{len(catalog.categories)} categories")
+    for column, size in catalog.memory_report().items():
+        print(f"{column:>12}: {size / 1024:10.1f} KiB")
+    print(f"{'measured':>12}: {retained / 1024:10.1f} KiB retained, "
+          f"{peak / 1024:.1f} KiB peak while loading")
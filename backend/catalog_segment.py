@@ -0,0 +1,112 @@
+import fcntl
+import os
+import shutil
+import time
+from contextlib import contextmanager
+
+from catalog import Catalog
+
+SEGMENT_DIR = os.getenv("CATALOG_SEGMENT_DIR", "catalog_segments")
+# Segments kept on disk, the current one included. A process still mapping
+# a deleted segment keeps working: the files live until it lets go.
+KEEP_SEGMENTS = 3
+
+
+class SegmentStore:
+    """
+    Catalogs shared by every serving process through memory-mapped files.
+
+    A segment is a directory written once by Catalog.save and mapped
+    read-only by Catalog.open, so N worker processes hold one copy of the
+    catalog in the page cache instead of N private copies. The `current`
+    symlink names the latest segment; it is replaced with a rename, so a
+    process either sees the old segment or the new one, never a partial
+    one. Publishing is serialized between processes with a file lock.
+    """
+
+    def __init__(self, directory=SEGMENT_DIR):
+        self.directory = directory
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def current(self):
+        # Name of the current segment, or None if none was published
+        try:
+            return os.readlink(self._path("current"))
+        except FileNotFoundError:
+            return None
+
+    def open(self, name):
+        return Catalog.open(self._path(name))
+
+    def compatible(self, name):
+        # False for segments written by an older layout of Catalog.save
+        try:
+            return Catalog.format_of(self._path(name)) == Catalog.FORMAT
+        except OSError:
+            return False
+
+    @staticmethod
+    def version_of(name):
+        # Segments are named catalog-<version>-<timestamp>
+        return int(name.split("-")[1])
+
+    @contextmanager
+    def lock(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path("lock"), "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def publish(self, catalog):
+        """
+        Write a catalog as a new segment and make it current, unless the
+        current segment is already as recent
+
+        Returns:
+            string: Name of the segment to open, the current one if it was
+                not replaced
+        """
+        with self.lock():
+            current = self.current()
+            if (current and self.version_of(current) >= catalog.version and
+                    self.compatible(current)):
+                return current
+
+            name = f"catalog-{catalog.version}-{time.time_ns()}"
+            catalog.save(self._path(name))
+
+            link = self._path(f"current.{os.getpid()}")
+            if os.path.lexists(link):
+                os.remove(link)
+            os.symlink(name, link)
+            os.replace(link, self._path("current"))
+
+            self._prune(name)
+            return name
+
+    def clear(self):
+        # Drop every segment, when the database they came from is replaced
+        with self.lock():
+            for name in os.listdir(self.directory):
+                if name != "lock":
+                    path = self._path(name)
+                    if os.path.isdir(path) and not os.path.islink(path):
+                        shutil.rmtree(path, ignore_errors=True)
+                    else:
+                        os.remove(path)
+
+    def _prune(self, current):
+        segments = sorted((n for n in os.listdir(self.directory)
+                           if n.startswith("catalog-")),
+                          key=lambda n: int(n.split("-")[2]))
+        for name in segments[:-KEEP_SEGMENTS]:
+            if name != current:
+                shutil.rmtree(self._path(name), ignore_errors=True)
+
+
+instance = SegmentStore()
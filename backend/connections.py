@@ -0,0 +1,156 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import migrations
+
+# Per-connection prepared statement cache (sqlite3 default: 128)
+CACHED_STATEMENTS = 512
+# Idle reader connections kept open per database
+MAX_IDLE_READERS = 16
+
+PRAGMAS = [
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA mmap_size = 268435456",  # 256 MiB
+    "PRAGMA cache_size = -65536",  # 64 MiB
+    "PRAGMA temp_store = MEMORY",
+]
+
+
+class ConnectionManager:
+    """
+    Long-lived sqlite connections for one database file.
+
+    Readers borrow a connection from a pool and give it back when done, so
+    the file open, schema parse, page cache and prepared statements are
+    reused across queries and requests. All writes go through a single
+    writer connection, one transaction at a time. WAL mode lets readers
+    run while a write is in progress.
+
+    Connections are never shared with a forked child: the pool is reset
+    when the process id changes. The first connection of a process brings
+    the file to the latest schema (see migrations).
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._migrated = False
+        self._migrate_lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._idle = []
+        self._writer = None
+        self._write_lock = threading.RLock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.filename,
+                               cached_statements=CACHED_STATEMENTS,
+                               check_same_thread=False)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        if not self._migrated:
+            with self._migrate_lock:
+                if not self._migrated:
+                    migrations.migrate(conn)
+                    self._migrated = True
+        return conn
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            self._reset()
+
+    @contextmanager
+    def read(self):
+        """
+        Borrow a connection for reading. Anything left uncommitted on it is
+        committed on exit, like `with sqlite3.connect(...)` would.
+        """
+        self._check_fork()
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = self._connect()
+
+        try:
+            yield conn
+            if conn.in_transaction:
+                conn.commit()
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            with self._lock:
+                if len(self._idle) < MAX_IDLE_READERS:
+                    self._idle.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+
+    @contextmanager
+    def write(self):
+        """
+        Use the writer connection. The block runs as one transaction:
+        committed on success, rolled back on error.
+        """
+        self._check_fork()
+        with self._write_lock:
+            if self._writer is None:
+                self._writer = self._connect()
+            conn = self._writer
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+
+    def close(self):
+        # Close every idle connection and the writer. The file may be
+        # replaced next, so the next connection checks its schema again.
+        self._migrated = False
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get(filename):
+    # The shared ConnectionManager of a database file
+    manager = _managers.get(filename)
+    if manager is None:
+        with _managers_lock:
+            manager = _managers.setdefault(filename,
+                                           ConnectionManager(filename))
+    return manager
+
+
+def read(filename):
+    """
+    Usage:
+        with connections.read(filename) as conn:
+            conn.execute(...)
+    """
+    return get(filename).read()
+
+
+def write(filename):
+    """
+    Usage:
+        with connections.write(filename) as conn:
+            conn.execute(...)
+    """
+    return get(filename).write()
@@ -0,0 +1,29 @@
+from collections import namedtuple
+
+# Published by Db after a write to the games table has been committed.
+# A batch write only publishes its last change; subscribers that see a gap
+# in versions catch up with the catalog_changes log.
+#   version: Row of the change in catalog_changes
+#   op: 'insert', 'delete' or 'price'
+#   price: New price for 'price' changes, None otherwise
+CatalogChange = namedtuple("CatalogChange", ["version", "appid", "op", "price"])
+
+_subscribers = []
+
+
+def subscribe(callback):
+    """
+    Call `callback(event)` for every published event.
+    Can be used as a decorator.
+    """
+    _subscribers.append(callback)
+    return callback
+
+
+def publish(event):
+    # Subscribers must not be able to break the write that published
+    for callback in list(_subscribers):
+        try:
+            callback(event)
+        except Exception as e:
+            print(f"Event subscriber {callback.__name__} failed: {e}")
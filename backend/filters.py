@@ -0,0 +1,208 @@
+import numpy as np
+
+from catalog import CONTROLLER_SUPPORT, PLATFORMS
+
+# Values listed per facet, most frequent first
+FACET_SIZE = 50
+
+
+def _items(index, n):
+    """
+    Params:
+        index (CsrIndex): Tags or categories of a catalog of n games
+
+    Returns:
+        (np.ndarray, np.ndarray, np.ndarray): Packed bitmap of the rows
+            having each item (one row of ceil(n / 8) bytes per vocabulary
+            column), the catalog row of every entry, and the number of
+            games having each item
+    """
+    rows = index.row_ids()
+    dense = np.zeros((len(index), n), dtype=bool)
+    dense[index.indices, rows] = True
+    return (np.packbits(dense, axis=1), rows,
+            np.bincount(index.indices, minlength=len(index)))
+
+
+def _counts(index, entry_rows, selected):
+    # Number of the selected rows having each item of a CsrIndex
+    rows = np.flatnonzero(selected)
+    if len(rows) * 8 < len(selected):
+        return index.counts(rows)  # Few rows: only read their entries
+    return np.bincount(index.indices[selected[entry_rows]],
+                       minlength=len(index))
+
+
+def _popcount(bitmap):
+    return int(np.unpackbits(bitmap).sum())
+
+
+class FilterIndex:
+    """
+    Bitmaps of the catalog rows having each tag, category, platform and
+    controller support level, so that filters combine with bitwise AND/OR
+    over n / 8 bytes instead of aggregating the relation tables.
+
+    A bitmap is a packed bool array over catalog rows (np.packbits). Like
+    the catalog the index is never modified: recommender.get_filter_index()
+    builds a new one whenever the catalog changes, reusing the tag and
+    category bitmaps if only prices changed.
+    """
+
+    def __init__(self, catalog, previous=None):
+        self.catalog = catalog
+        n = len(catalog)
+
+        # Per item: bitmaps, the catalog row of every entry and the number
+        # of games having it (to count the facets of large results)
+        if previous is not None and previous.catalog.tags is catalog.tags:
+            self.tags, self.tag_rows, self.tag_totals = (
+                    previous.tags, previous.tag_rows, previous.tag_totals)
+        else:
+            self.tags, self.tag_rows, self.tag_totals = _items(catalog.tags, n)
+        if (previous is not None and
+                previous.catalog.categories is catalog.categories):
+            self.categories, self.category_rows, self.category_totals = (
+                    previous.categories, previous.category_rows,
+                    previous.category_totals)
+        else:
+            self.categories, self.category_rows, self.category_totals = (
+                    _items(catalog.categories, n))
+
+        self.platforms = {name: np.packbits(catalog.platforms & bit != 0)
+                          for name, bit in PLATFORMS.items()}
+        self.controller_support = {
+                name: np.packbits(catalog.controller_support == value)
+                for name, value in CONTROLLER_SUPPORT.items()}
+        self.all = np.packbits(np.ones(n, dtype=bool))
+
+    @property
+    def nbytes(self):
+        return (self.tags.nbytes + self.categories.nbytes +
+                self.tag_rows.nbytes + self.category_rows.nbytes +
+                sum(b.nbytes for b in self.platforms.values()) +
+                sum(b.nbytes for b in self.controller_support.values()))
+
+    def _items(self, bitmaps, index, ids, match_all):
+        # AND (or OR) of the bitmaps of the given database ids. An unknown
+        # id matches no game.
+        if len(index.ids) == 0:
+            return np.zeros_like(self.all)
+        columns = np.searchsorted(index.ids, ids)
+        known = ((columns < len(index.ids)) &
+                 (index.ids[np.minimum(columns, len(index.ids) - 1)] == ids))
+        if match_all:
+            if not known.all():
+                return np.zeros_like(self.all)
+            return np.bitwise_and.reduce(bitmaps[columns], axis=0)
+        if not known.any():
+            return np.zeros_like(self.all)
+        return np.bitwise_or.reduce(bitmaps[columns[known]], axis=0)
+
+    def filter(self, tags=(), categories=(), match_all=True,
+               min_price=None, max_price=None, platforms=(),
+               controller_support=()):
+        """
+        Games matching every given filter
+
+        Params:
+            tags, categories (list[int]): Database ids
+            match_all (bool): Games must have every tag and every category /
+                at least one tag and one category of those given
+            min_price, max_price (float): Price range in cents, inclusive.
+                Games without a price only match if no range is given.
+            platforms (list[string]): Keys of PLATFORMS, all required
+            controller_support (list[string]): Keys of CONTROLLER_SUPPORT,
+                any of them
+
+        Returns:
+            np.ndarray: Packed bitmap of the matching catalog rows
+        """
+        result = self.all.copy()
+        if len(tags):
+            result &= self._items(self.tags, self.catalog.tags,
+                                  np.asarray(tags, dtype=np.int64), match_all)
+        if len(categories):
+            result &= self._items(self.categories, self.catalog.categories,
+                                  np.asarray(categories, dtype=np.int64),
+                                  match_all)
+        for name in platforms:
+            result &= self.platforms[name]
+        if controller_support:
+            result &= np.bitwise_or.reduce(
+                    [self.controller_support[name]
+                     for name in controller_support], axis=0)
+
+        if min_price is not None or max_price is not None:
+            prices = self.catalog.prices
+            # NaN prices compare False
+            in_range = np.ones(len(prices), dtype=bool)
+            if min_price is not None:
+                in_range &= prices >= min_price
+            if max_price is not None:
+                in_range &= prices <= max_price
+            result &= np.packbits(in_range)
+        return result
+
+    def count(self, bitmap):
+        # Number of games in a bitmap
+        return _popcount(bitmap)
+
+    def rows(self, bitmap):
+        # Catalog rows of a bitmap, in appid order
+        return np.flatnonzero(np.unpackbits(bitmap, count=len(self.catalog)))
+
+    def top(self, bitmap, limit, offset=0):
+        """
+        Most reviewed games of a bitmap, ties in appid order
+
+        Returns:
+            np.ndarray: Catalog rows of the page
+        """
+        depth = offset + limit
+        if limit <= 0:
+            return np.zeros(0, dtype=np.int64)
+        rows = self.rows(bitmap)
+        reviews = self.catalog.total_reviews[rows]
+        if depth < len(rows):
+            # Only the rows that can reach the page are sorted
+            keep = np.argpartition(-reviews, depth - 1)[:depth]
+            threshold = reviews[keep].min()
+            keep = np.flatnonzero(reviews >= threshold)
+            rows, reviews = rows[keep], reviews[keep]
+        order = np.lexsort((rows, -reviews.astype(np.int64)))
+        return rows[order][offset:depth]
+
+    def facets(self, bitmap, size=FACET_SIZE):
+        """
+        Number of the matching games having each tag, category, platform
+        and controller support level
+
+        Returns:
+            dict: {tags, categories: [{id, name, count}] most frequent
+                first, at most `size` each; platforms, controller_support:
+                {name: count}}
+        """
+        selected = np.unpackbits(bitmap, count=len(self.catalog)).view(bool)
+        matched = int(selected.sum())
+        out = {}
+        for facet, index, entry_rows, totals in (
+                ("tags", self.catalog.tags, self.tag_rows, self.tag_totals),
+                ("categories", self.catalog.categories, self.category_rows,
+                 self.category_totals)):
+            if matched * 2 > len(selected):
+                # Most games: count the others instead
+                counts = totals - _counts(index, entry_rows, ~selected)
+            else:
+                counts = _counts(index, entry_rows, selected)
+            columns = np.flatnonzero(counts)
+            columns = columns[np.lexsort((columns, -counts[columns]))][:size]
+            out[facet] = [{"id": int(index.ids[c]), "name": index.names[c],
+                           "count": int(counts[c])} for c in columns]
+
+        out["platforms"] = {name: _popcount(bitmap & b)
+                            for name, b in self.platforms.items()}
+        out["controller_support"] = {
+                name: _popcount(bitmap & b)
+                for name, b in self.controller_support.items()}
+        return out
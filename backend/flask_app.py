@@ -1,7 +1,10 @@
 from flask import Flask
 from flask_cors import CORS
+import instrumentation
 
 
 # Set up the server and allow requests from the frontend container
 app = Flask(__name__)
 CORS(app)
+# Per-request Server-Timing breakdowns and latency histograms
+instrumentation.init_app(app)
@@ -0,0 +1,81 @@
+import numpy as np
+
+# A hidden gem has between MIN_REVIEWS and MAX_REVIEWS reviews (exclusive)
+# and more than MIN_POSITIVE_RATIO of them positive
+MIN_REVIEWS = 50
+MAX_REVIEWS = 500
+MIN_POSITIVE_RATIO = 0.9
+
+
+class GemIndex:
+    """
+    Hidden gems of a catalog, scored against a user's library at once.
+
+    Holds the catalog rows of every gem and their tags as a gem x tag
+    matrix (a slice of the catalog's tag index). Like the catalog it is
+    never modified: recommender.get_gem_index() builds a new one whenever
+    the catalog changes, so review counts are always current.
+    """
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+
+        total = catalog.total_reviews
+        gem = (total > MIN_REVIEWS) & (total < MAX_REVIEWS)
+        gem[gem] = (catalog.positive_reviews[gem] / total[gem] >
+                    MIN_POSITIVE_RATIO)
+        self.rows = np.flatnonzero(gem)
+
+        self.tags = catalog.tags.take(self.rows)
+        self.tag_rows = self.tags.row_ids()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def tag_weights(self, library):
+        """
+        Weight of every tag for a user: log(1 + hours played) summed over
+        the owned games having the tag
+
+        Params:
+            library (dict): {appid: playtime in minutes}
+
+        Returns:
+            np.ndarray: One weight per tag column of the catalog
+        """
+        catalog = self.catalog
+        appids = np.fromiter(library, dtype=np.int64, count=len(library))
+        playtime = np.fromiter((p or 0 for p in library.values()),
+                               dtype=np.float64, count=len(library))
+
+        rows = np.searchsorted(catalog.appids, appids)
+        known = rows < len(catalog)
+        known[known] = catalog.appids[rows[known]] == appids[known]
+
+        return catalog.tags.counts(rows[known],
+                                   np.log1p(playtime[known] / 60))
+
+    def score(self, library):
+        """
+        Score every gem: sum of the user's weights of its tags
+
+        Params:
+            library (dict): {appid: playtime in minutes}
+
+        Returns:
+            np.ndarray: Score of every gem, in the order of self.rows
+        """
+        weights = self.tag_weights(library)
+        return np.bincount(self.tag_rows, weights=weights[self.tags.indices],
+                           minlength=len(self))
+
+    def top(self, library, k=50):
+        """
+        Best gems for a user, ties in appid order
+
+        Returns:
+            list[int]: appids, best first
+        """
+        scores = self.score(library)
+        order = np.lexsort((self.rows, -scores))[:k]
+        return self.catalog.appids[self.rows[order]].tolist()
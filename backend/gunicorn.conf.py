@@ -0,0 +1,12 @@
+# gunicorn -c gunicorn.conf.py wsgi:app
+import os
+
+bind = "0.0.0.0:5000"
+workers = int(os.getenv("WEB_CONCURRENCY", 4))
+# Seen by the app: each worker takes its share of the upstream rate limits
+# (see scheduler.PROCESSES)
+os.environ["WEB_CONCURRENCY"] = str(workers)
+threads = int(os.getenv("WEB_THREADS", 4))
+# Load the app (and map the catalog) once, before forking the workers
+preload_app = True
+timeout = 60
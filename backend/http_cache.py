@@ -0,0 +1,241 @@
+"""
+Response cache of the read endpoints.
+
+A response is stored under a key made of its route, its arguments and the
+versions of the data it was computed from: the catalog version (see
+Db.get_catalog_version) and, for per-user routes, the user's library sync
+version. Writes never invalidate an entry. They bump a version, so the next
+request has a new key, and entries of older versions age out of the LRU.
+
+Every cached response carries a strong ETag, the hash of its body. A
+request whose If-None-Match holds the ETag of the entry for its key gets a
+304 without the route running.
+
+Entries are kept in an in-process LRU. An optional shared backend (any
+object with get(key) and put(key, entry), such as SqliteBackend) lets the
+workers of a host serve the entries any of them computed.
+"""
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from flask import make_response, request
+
+# Bounds of the in-process LRU
+MAX_ENTRIES = int(os.getenv("HTTP_CACHE_ENTRIES", 1024))
+MAX_BYTES = int(os.getenv("HTTP_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+# sqlite file shared by the workers of a host, none if unset
+SHARED_DB = os.getenv("HTTP_CACHE_SHARED_DB")
+# Entries kept in the shared file, the oldest stored are deleted past it
+SHARED_MAX_ENTRIES = int(os.getenv("HTTP_CACHE_SHARED_ENTRIES", 16384))
+
+
+def etag_of(body):
+    # Strong validator: the same bytes always give the same ETag
+    return hashlib.sha256(body).hexdigest()
+
+
+class SqliteBackend:
+    """
+    Shared cache entries in a local sqlite file.
+
+    Every process opens its own connection (none is inherited through a
+    fork). Entries are (etag, body, mimetype) rows; past max_entries the
+    oldest stored are deleted.
+    """
+
+    def __init__(self, filename, max_entries=SHARED_MAX_ENTRIES):
+        self.filename = filename
+        self.max_entries = max_entries
+        self._pid = None
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        # Called with the lock held
+        if self._pid != os.getpid():
+            conn = sqlite3.connect(self.filename, timeout=5,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            with conn:
+                # The rowid grows with every put, REPLACE included
+                conn.execute("""
+                             CREATE TABLE IF NOT EXISTS responses (
+                                 id INTEGER PRIMARY KEY,
+                                 key TEXT NOT NULL UNIQUE,
+                                 etag TEXT NOT NULL,
+                                 body BLOB NOT NULL,
+                                 mimetype TEXT NOT NULL
+                             )
+                             """)
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def get(self, key):
+        with self._lock:
+            row = self._connect().execute("""
+                                          SELECT etag, body, mimetype
+                                          FROM responses WHERE key = ?
+                                          """, (key,)).fetchone()
+        return (row[0], bytes(row[1]), row[2]) if row else None
+
+    def put(self, key, entry):
+        etag, body, mimetype = entry
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                cur = conn.execute("""
+                                   INSERT OR REPLACE INTO responses
+                                       (key, etag, body, mimetype)
+                                   VALUES (?, ?, ?, ?)
+                                   """, (key, etag, body, mimetype))
+                conn.execute("DELETE FROM responses WHERE id <= ?",
+                             (cur.lastrowid - self.max_entries,))
+
+
+class ResponseCache:
+    """
+    LRU of (etag, body, mimetype) entries by key, bounded in number and in
+    total body size, in front of an optional shared backend.
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES,
+                 shared=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.shared = shared
+        self.counters = {"hits": 0, "shared_hits": 0, "misses": 0,
+                         "not_modified": 0, "stored": 0, "evicted": 0}
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns:
+            (string, bytes, string): ETag, body and mimetype, or None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.counters["hits"] += 1
+                return entry
+
+        if self.shared is not None:
+            try:
+                entry = self.shared.get(key)
+            except Exception as e:
+                print(f"Shared response cache unavailable: {e}")
+                entry = None
+            if entry is not None:
+                self._store(key, entry)
+                self.count("shared_hits")
+                return entry
+
+        self.count("misses")
+        return None
+
+    def put(self, key, entry):
+        self._store(key, entry)
+        self.count("stored")
+        if self.shared is not None:
+            try:
+                self.shared.put(key, entry)
+            except Exception as e:
+                print(f"Shared response cache unavailable: {e}")
+
+    def _store(self, key, entry):
+        size = len(entry[1])
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[1])
+            self._entries[key] = entry
+            self._bytes += size
+            while (len(self._entries) > self.max_entries or
+                   self._bytes > self.max_bytes):
+                _, old = self._entries.popitem(last=False)
+                self._bytes -= len(old[1])
+                self.counters["evicted"] += 1
+
+    def count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+        lookups = stats["hits"] + stats["shared_hits"] + stats["misses"]
+        stats["hit_rate"] = ((stats["hits"] + stats["shared_hits"]) / lookups
+                             if lookups else 0.0)
+        return stats
+
+
+def _not_modified(etag):
+    # If-None-Match compares weakly (RFC 9110 13.1.2)
+    return request.if_none_match.contains_weak(etag)
+
+
+def _respond(entry):
+    etag, body, mimetype = entry
+    if _not_modified(etag):
+        instance.count("not_modified")
+        response = make_response("", 304)
+    else:
+        response = make_response(body)
+        response.mimetype = mimetype
+    response.set_etag(etag)
+    # Clients may store the answer, but must revalidate it on every use
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+def cached(key):
+    """
+    Route decorator: serve the responses of a view from the cache. Only 200
+    responses are stored.
+
+    Params:
+        key (callable): Returns a tuple identifying the answer to the
+            current request, the versions of the data it depends on
+            included, or None to run the view without the cache (invalid
+            arguments, data that is not stored yet...)
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            parts = key()
+            if parts is None:
+                return view(*args, **kwargs)
+            cache_key = request.path + json.dumps(parts)
+
+            entry = instance.get(cache_key)
+            if entry is None:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                body = response.get_data()
+                entry = (etag_of(body), body, response.mimetype)
+                instance.put(cache_key, entry)
+            return _respond(entry)
+        return wrapper
+    return decorator
+
+
+instance = ResponseCache(
+        shared=SqliteBackend(SHARED_DB) if SHARED_DB else None)
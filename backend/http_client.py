@@ -0,0 +1,120 @@
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import scheduler
+
+# (connect, read) timeouts in seconds
+TIMEOUT = (3.05, 15)
+# Attempts after the first one
+RETRIES = 3
+# Backoff before retry n is uniform in [0, min(BACKOFF_MAX, BACKOFF * 2**n)]
+BACKOFF = 0.5
+BACKOFF_MAX = 8.0
+# Requests in flight per host
+PER_HOST_LIMIT = 16
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class HttpClient:
+    """
+    Shared HTTP client for every upstream call.
+
+    One requests.Session keeps keep-alive connections per host, so calls
+    after the first skip the TCP/TLS handshake. Every request has a timeout,
+    is retried with jittered exponential backoff on connection errors,
+    timeouts, 429 and 5xx, and waits for a per-host slot so that one host
+    cannot take every connection. Calls to a rate-limited endpoint also
+    go through the scheduler (see scheduler.Scheduler), once per attempt.
+
+    get() is blocking and thread-safe: callers fan out with a thread pool
+    (see ingest.py).
+    """
+
+    def __init__(self, timeout=TIMEOUT, retries=RETRIES,
+                 per_host_limit=PER_HOST_LIMIT):
+        self.timeout = timeout
+        self.retries = retries
+        self.per_host_limit = per_host_limit
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=per_host_limit)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._hosts = {}
+        self._hosts_lock = threading.Lock()
+
+    def _host_slots(self, url):
+        host = urlparse(url).netloc
+        with self._hosts_lock:
+            slots = self._hosts.get(host)
+            if slots is None:
+                slots = threading.BoundedSemaphore(self.per_host_limit)
+                self._hosts[host] = slots
+            return slots
+
+    def get(self, url, params=None, headers=None, timeout=None,
+            endpoint=None, priority=scheduler.BACKGROUND):
+        """
+        GET a URL
+
+        Params:
+            url (string): URL to fetch
+            params (dict): Query parameters
+            headers (dict): Extra request headers
+            timeout: Overrides the client's (connect, read) timeout
+            endpoint (string): Scheduler endpoint the URL belongs to
+                (see scheduler.LIMITS), None for no rate limit
+            priority (int): Scheduler priority of the call
+
+        Returns:
+            requests.Response: The last response. It can still have a 429 or
+                5xx status if every retry failed.
+
+        Raises:
+            requests.RequestException: If the last attempt failed without
+                a response
+        """
+        slots = self._host_slots(url)
+        attempt = 0
+        while True:
+            if endpoint:
+                scheduler.instance.acquire(endpoint, priority)
+            try:
+                with slots:
+                    res = self.session.get(url, params=params,
+                                           headers=headers,
+                                           timeout=timeout or self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if endpoint:
+                    scheduler.instance.report(endpoint, None)
+                if attempt >= self.retries:
+                    raise
+                time.sleep(self._backoff(attempt))
+                attempt += 1
+                continue
+
+            if endpoint:
+                scheduler.instance.report(endpoint, res.status_code)
+            if res.status_code not in RETRY_STATUSES or attempt >= self.retries:
+                return res
+
+            time.sleep(self._backoff(attempt, res))
+            attempt += 1
+
+    def _backoff(self, attempt, res=None):
+        # Honor Retry-After when the upstream sends one
+        if res is not None:
+            retry_after = res.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                return min(float(retry_after), BACKOFF_MAX)
+        return random.uniform(0, min(BACKOFF_MAX, BACKOFF * 2 ** attempt))
+
+
+instance = HttpClient()
@@ -0,0 +1,188 @@
+"""
+Bulk ingestion of Steam apps into the games database.
+
+Store and SteamSpy details are fetched concurrently by a bounded pool of
+workers, and parsed games are written in large batches (see
+Db.insert_games).
+
+Usage:
+    python ingest.py [options] appids.txt     # one appid per line
+    python ingest.py [options] 10 20 30
+    cat appids.txt | python ingest.py [options] -
+
+Options:
+    --workers N           Concurrent fetches (default 8)
+    --batch-size N        Games per write transaction (default 500)
+    --db FILE             Database to write to (default steam_games.db)
+    --store-url URL       Steam store appdetails endpoint
+    --steamspy-url URL    SteamSpy appdetails endpoint (appid is appended)
+    --store-rate R        Store requests per second (see scheduler.LIMITS)
+    --steamspy-rate R     SteamSpy requests per second
+"""
+import argparse
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import Db
+import SteamStoreAPI as ssa
+import appdetails_cache
+import scheduler
+
+STATUS_NAMES = {
+    -1: "invalid_response",
+    -2: "not_found",
+    -3: "not_a_game",
+    -4: "error",
+}
+
+
+def fetch_app(db, appid):
+    """
+    Fetch and parse one app, the same way Db.insert_game_by_appid does,
+    at background priority
+
+    Returns:
+        (int, dict): Status (see Db.parse_store_details, -4 on exception)
+            and parsed row info
+    """
+    try:
+        app = ssa.get_steam_app_details(appid, scheduler.BACKGROUND)
+        status, info = db.parse_store_details(appid, app)
+        if status != 0:
+            return status, None
+
+        appss = ssa.get_steam_app_details_steamspy(appid,
+                                                   scheduler.BACKGROUND)
+        db.add_steamspy_details(info, appss)
+        return 0, info
+    except Exception as e:
+        print(f"Failed to fetch {appid}: {e}")
+        return -4, None
+
+
+def ingest_apps(appids, workers=8, batch_size=500, db=None, report=None):
+    """
+    Fetch and insert many apps
+
+    Params:
+        appids (list[int]): Apps to ingest
+        workers (int): Maximum number of apps fetched at the same time
+        batch_size (int): Games written per transaction
+        db (Db.Db): Database to write to (default Db.instance)
+        report (callable): Called with the stats after every batch
+
+    Returns:
+        dict: {
+                requested, inserted, skipped {reason: count},
+                seconds, apps_per_second
+              }
+    """
+    db = db or Db.instance
+    stats = {"requested": len(appids), "inserted": 0, "skipped": Counter()}
+    start = time.perf_counter()
+
+    def flush(batch):
+        stats["inserted"] += db.insert_games(batch)
+        batch.clear()
+        elapsed = time.perf_counter() - start
+        stats["seconds"] = elapsed
+        done = stats["inserted"] + sum(stats["skipped"].values())
+        stats["apps_per_second"] = done / elapsed if elapsed else 0.0
+        if report:
+            report(stats)
+
+    batch = []
+    pending = set()
+    todo = iter(appids)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # Keep a bounded window of fetches in flight
+        for appid in todo:
+            pending.add(pool.submit(fetch_app, db, appid))
+            if len(pending) < workers * 2:
+                continue
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                status, info = future.result()
+                if status == 0:
+                    batch.append(info)
+                else:
+                    stats["skipped"][STATUS_NAMES[status]] += 1
+            if len(batch) >= batch_size:
+                flush(batch)
+
+        for future in pending:
+            status, info = future.result()
+            if status == 0:
+                batch.append(info)
+            else:
+                stats["skipped"][STATUS_NAMES[status]] += 1
+
+    flush(batch)
+    stats["skipped"] = dict(stats["skipped"])
+    return stats
+
+
+def read_appids(args):
+    appids = []
+    for arg in args:
+        if arg.isdigit():
+            appids.append(int(arg))
+            continue
+        source = sys.stdin if arg == "-" else open(arg)
+        with source:
+            appids.extend(int(line) for line in source if line.strip())
+    return appids
+
+
+def main():
+    parser = argparse.ArgumentParser(
+            description="Insert many Steam apps into the games database")
+    parser.add_argument("appids", nargs="+",
+                        help="appids, files of appids, or - for stdin")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--db", default=Db.instance.filename)
+    parser.add_argument("--store-url")
+    parser.add_argument("--steamspy-url")
+    parser.add_argument("--store-rate", type=float)
+    parser.add_argument("--steamspy-rate", type=float)
+    args = parser.parse_args()
+
+    if args.store_url:
+        ssa.base_url = args.store_url
+    if args.steamspy_url:
+        ssa.base_url_steamspy = args.steamspy_url
+    if args.store_rate:
+        scheduler.instance.set_limit("store", args.store_rate,
+                                     max(1, int(args.store_rate)))
+    if args.steamspy_rate:
+        scheduler.instance.set_limit("steamspy", args.steamspy_rate,
+                                     max(1, int(args.steamspy_rate)))
+
+    appids = read_appids(args.appids)
+
+    def report(stats):
+        done = stats["inserted"] + sum(stats["skipped"].values())
+        print(f"{done}/{stats['requested']} apps, "
+              f"{stats['apps_per_second']:.1f} apps/s")
+
+    stats = ingest_apps(appids, args.workers, args.batch_size,
+                        Db.Db(args.db), report)
+
+    print(f"Inserted {stats['inserted']} of {stats['requested']} apps "
+          f"in {stats['seconds']:.1f}s ({stats['apps_per_second']:.1f} apps/s)")
+    for reason, count in stats["skipped"].items():
+        print(f"  skipped ({reason}): {count}")
+
+    cache = appdetails_cache.instance.stats()
+    print(f"appdetails cache: {cache['hits']} hits, "
+          f"{cache['revalidated']} revalidated, {cache['stale']} stale, "
+          f"{cache['misses']} misses "
+          f"({cache['hit_rate']:.0%} hit rate)")
+
+
+if __name__ == "__main__":
+    main()
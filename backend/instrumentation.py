@@ -0,0 +1,300 @@
+"""
+Where request time goes: timing spans, latency histograms and an opt-in
+sampling profiler.
+
+A span times a block of code (span) or every call of a function (timed,
+time_methods). Each finished span is added to the latency histogram of its
+name and, inside a request, to the request's breakdown, which init_app
+sends back in a Server-Timing header:
+
+    Server-Timing: db.get_sync_state;dur=0.08;desc="1 call",
+        recommender.score;dur=41.20;desc="1 call", total;dur=48.91
+
+Spans may nest (a Db call inside a recommender stage counts in both).
+Histograms and the profiler are per process: with several gunicorn
+workers, each one reports its own requests.
+
+The sampling profiler is off unless SAMPLING_PROFILER=1 or it is turned on
+through POST /metrics/profile. While on, a thread records the stack of every
+thread serving a request every SAMPLE_INTERVAL seconds, as collapsed
+stacks (flamegraph.pl / speedscope input).
+"""
+import bisect
+import contextvars
+import functools
+import inspect
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+ENABLED = os.getenv("INSTRUMENTATION", "1") != "0"
+# Start the sampling profiler with every worker
+SAMPLING_PROFILER = os.getenv("SAMPLING_PROFILER") == "1"
+# Upper bounds of the histogram buckets, in milliseconds
+BUCKETS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000,
+           2500, 5000, 10000]
+SAMPLE_INTERVAL = float(os.getenv("SAMPLE_INTERVAL", 0.005))  # seconds
+# Distinct stacks kept by the profiler, later ones are counted as dropped
+MAX_STACKS = 10000
+
+# {name: [duration in ms, calls]} of the current request, None outside one
+_request_spans = contextvars.ContextVar("request_spans", default=None)
+
+
+class Histogram:
+    """Counts of durations per bucket, with their sum and maximum."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # Last one: over BUCKETS[-1]
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def add(self, ms):
+        self.counts[bisect.bisect_left(BUCKETS, ms)] += 1
+        self.count += 1
+        self.sum += ms
+        self.max = max(self.max, ms)
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th duration
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(BUCKETS, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean_ms": self.sum / self.count if self.count else 0.0,
+            "max_ms": self.max,
+            "p50_ms": self.quantile(0.5),
+            "p90_ms": self.quantile(0.9),
+            "p99_ms": self.quantile(0.99),
+            "buckets": [{"le": bound, "count": n}
+                        for bound, n in zip(BUCKETS + ["+Inf"], self.counts)],
+        }
+
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+
+def record(name, ms):
+    # Add a finished span to its histogram and to the current request
+    with _histograms_lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.add(ms)
+
+    spans = _request_spans.get()
+    if spans is not None:
+        entry = spans.get(name)
+        if entry is None:
+            spans[name] = [ms, 1]
+        else:
+            entry[0] += ms
+            entry[1] += 1
+
+
+@contextmanager
+def span(name):
+    """
+    Usage:
+        with instrumentation.span("recommender.score"):
+            ...
+    """
+    if not ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, (time.perf_counter() - start) * 1e3)
+
+
+def timed(name):
+    # Decorator: a span around every call of a function
+    def decorator(fn):
+        if not ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record(name, (time.perf_counter() - start) * 1e3)
+        return wrapper
+    return decorator
+
+
+def time_methods(cls, prefix):
+    # Time every public method of a class, as "<prefix>.<method>"
+    for name, value in list(vars(cls).items()):
+        if inspect.isfunction(value) and not name.startswith("_"):
+            setattr(cls, name, timed(f"{prefix}.{name}")(value))
+    return cls
+
+
+def histograms():
+    """
+    Returns:
+        dict: {span name: {count, mean_ms, max_ms, p50_ms, p90_ms, p99_ms,
+            buckets: [{le, count}]}}. Percentiles are bucket upper bounds.
+    """
+    with _histograms_lock:
+        return {name: h.summary() for name, h in sorted(_histograms.items())}
+
+
+def server_timing(spans, total_ms):
+    # Server-Timing header value of a request's spans, slowest first
+    entries = [f'{name};dur={ms:.2f};desc="{calls} call'
+               f'{"" if calls == 1 else "s"}"'
+               for name, (ms, calls) in sorted(spans.items(),
+                                               key=lambda s: -s[1][0])]
+    entries.append(f"total;dur={total_ms:.2f}")
+    return ", ".join(entries)
+
+
+# ---------------------------
+# Sampling profiler
+# ---------------------------
+_active_threads = set()  # idents of the threads serving a request
+
+
+class SamplingProfiler:
+    """
+    Collapsed stacks of the threads serving requests, sampled from a
+    background thread. Costs nothing while stopped.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.dropped = 0
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        with self._lock:
+            if self.running:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run,
+                                            name="sampling-profiler",
+                                            daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+
+    def reset(self):
+        with self._lock:
+            self.stacks.clear()
+            self.samples = self.dropped = 0
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                for ident in list(_active_threads):
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        self._add(frame)
+
+    def _add(self, frame):
+        # Called with the lock held
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{os.path.basename(code.co_filename)}:"
+                         f"{code.co_name}")
+            frame = frame.f_back
+        stack = ";".join(reversed(names))
+        self.samples += 1
+        if stack in self.stacks or len(self.stacks) < MAX_STACKS:
+            self.stacks[stack] += 1
+        else:
+            self.dropped += 1
+
+    def report(self, limit=100):
+        """
+        Returns:
+            dict: {running, interval, samples, dropped, stacks: [{stack,
+                count}] most sampled first, at most `limit`}
+        """
+        with self._lock:
+            top = self.stacks.most_common(limit)
+            out = {"running": self.running, "interval": self.interval,
+                   "samples": self.samples, "dropped": self.dropped}
+        out["stacks"] = [{"stack": stack, "count": count}
+                         for stack, count in top]
+        return out
+
+
+profiler = SamplingProfiler()
+
+
+# ---------------------------
+# Flask integration
+# ---------------------------
+def init_app(app):
+    """
+    Time every request of a Flask app: one histogram per route, and the
+    spans of the request in its Server-Timing header
+    """
+    from flask import g, request
+
+    if not ENABLED:
+        return
+    started_in = set()  # pids whose profiler was started by SAMPLING_PROFILER
+
+    @app.before_request
+    def start_request():
+        # Started on the first request of each process, not at import: a
+        # thread started before gunicorn forks would not run in the workers
+        if SAMPLING_PROFILER and os.getpid() not in started_in:
+            started_in.add(os.getpid())
+            profiler.start()
+        g.instrumentation_start = time.perf_counter()
+        g.instrumentation_token = _request_spans.set({})
+        _active_threads.add(threading.get_ident())
+
+    @app.after_request
+    def finish_request(response):
+        start = g.pop("instrumentation_start", None)
+        if start is None:
+            return response
+        total = (time.perf_counter() - start) * 1e3
+        spans = _request_spans.get() or {}
+        response.headers["Server-Timing"] = server_timing(spans, total)
+        rule = request.url_rule.rule if request.url_rule else "unmatched"
+        record(f"request {request.method} {rule}", total)
+        return response
+
+    @app.teardown_request
+    def end_request(exc):
+        _active_threads.discard(threading.get_ident())
+        token = g.pop("instrumentation_token", None)
+        if token is not None:
+            _request_spans.reset(token)
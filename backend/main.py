@@ -7,34 +7,104 @@ from routes.recommend.recommender import recommend_bp
 
 # DB-related routes
 import routes.db.game
+import routes.db.games
 import routes.db.insert
 import routes.db.delete
 import routes.db.update
 import routes.recommend.gems
+import routes.recommend.similar
+import routes.filter
+import routes.metrics
+import routes.ready
+import routes.search
 
+import hashlib
+import json
+import os
 import tarfile
-import sqlite3
+import catalog_segment
+import connections
+import recommender
+import warmup
+
+DEBUG = True
+DB_FILE = "steam_games.db"
+ARCHIVE = "steam_games.db.tar.gz"
+# Checksum of the archive the database was last extracted from
+CHECKSUM_FILE = "steam_games.db.tar.gz.sha256"
 
 
 # ---------------------------
-# Ensure user table exists
+# Prepare the database
 # ---------------------------
-def ensure_user_table():
-    conn = sqlite3.connect("steam_games.db")
-    cur = conn.cursor()
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS user_owned_games (
-            user_id TEXT NOT NULL,
-            appid INTEGER NOT NULL,
-            playtime INTEGER,
-            PRIMARY KEY (user_id, appid),
-            FOREIGN KEY(appid) REFERENCES games(appid)
-        );
-    """)
-    conn.commit()
-    conn.close()
-
-ensure_user_table()
+def archive_checksum(stored=None):
+    """
+    Fingerprint of the archive: {sha256, size, mtime}. The file is only
+    hashed if its size or mtime differs from the stored fingerprint.
+    """
+    st = os.stat(ARCHIVE)
+    if (stored and stored.get("size") == st.st_size and
+            stored.get("mtime") == st.st_mtime):
+        return stored
+
+    h = hashlib.sha256()
+    with open(ARCHIVE, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return {"sha256": h.hexdigest(), "size": st.st_size,
+            "mtime": st.st_mtime}
+
+
+def prepare_db():
+    """
+    Extract the archived database, only if there is no database yet or
+    the archive changed since it was last extracted. Otherwise the live
+    database, with everything written at runtime, is kept.
+
+    Returns:
+        bool: True if the database was extracted
+    """
+    if not os.path.exists(ARCHIVE):
+        return False
+
+    try:
+        with open(CHECKSUM_FILE) as f:
+            stored = json.load(f)
+    except (OSError, ValueError):
+        stored = None
+
+    checksum = archive_checksum(stored)
+    if (os.path.exists(DB_FILE) and stored and
+            stored["sha256"] == checksum["sha256"]):
+        if checksum is not stored:
+            # Same content, new mtime: skip hashing next time
+            with open(CHECKSUM_FILE, "w") as f:
+                json.dump(checksum, f)
+        return False
+
+    # The file is about to be replaced: drop pooled connections and the
+    # WAL of the old file, or SQLite would replay it onto the new one
+    connections.get(DB_FILE).close()
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(DB_FILE + suffix):
+            os.remove(DB_FILE + suffix)
+
+    with tarfile.open(ARCHIVE, "r:gz") as tar:
+        tar.extractall(path=".")
+
+    # Shared catalogs and the similar-games index were built from the old
+    # file, possibly at the same catalog version
+    catalog_segment.instance.clear()
+    if os.path.exists(recommender.SIMILARITY_FILE):
+        os.remove(recommender.SIMILARITY_FILE)
+
+    with open(CHECKSUM_FILE, "w") as f:
+        json.dump(checksum, f)
+    return True
+
+
+# Before the first connection migrates the file (see migrations)
+prepare_db()
 
 
 # ---------------------------
@@ -49,8 +119,9 @@ app.register_blueprint(recommend_bp)
 # Run server
 # ---------------------------
 if __name__ == "__main__":
-    # Extract DB if needed
-    with tarfile.open("steam_games.db.tar.gz", "r:gz") as tar:
-        tar.extractall(path=".")
+    # With the debug reloader this runs twice; only the child that serves
+    # requests warms up
+    if not DEBUG or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        warmup.start()
 
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    app.run(host="0.0.0.0", port=5000, debug=DEBUG)
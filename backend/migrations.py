@@ -0,0 +1,441 @@
+"""
+Versioned schema of steam_games.db.
+
+The database's PRAGMA user_version is the number of migrations applied.
+Every connection opened through `connections` migrates the file once per
+process, before it is used (see ConnectionManager._connect), so no module
+creates its own tables anymore. Migrations are only ever appended: a
+database at any version is brought to the latest one.
+
+Usage (from backend/):
+    python migrations.py [--db FILE] [--check]
+
+--check prints the query plan of every hot query (HOT_QUERIES) and exits
+with status 1 if one of them scans a whole table.
+"""
+import argparse
+import sqlite3
+import sys
+
+_filename = "steam_games.db"
+
+# (description, statements). The version of a database is the number of
+# migrations applied to it.
+MIGRATIONS = [
+    ("Baseline schema, see docs/DB Schema.md", [
+        """
+        CREATE TABLE IF NOT EXISTS games (
+            appid INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            controller_support INTEGER,
+            has_achievements BOOLEAN,
+            supports_windows BOOLEAN,
+            supports_mac BOOLEAN,
+            supports_linux BOOLEAN,
+            price REAL,
+            release_date DATETIME,
+            header_image TEXT,
+            positive_reviews INTEGER,
+            negative_reviews INTEGER,
+            total_reviews INTEGER
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS categories (
+            id INTEGER PRIMARY KEY,
+            name TEXT UNIQUE NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS game_categories (
+            appid INTEGER NOT NULL REFERENCES games(appid),
+            cid INTEGER NOT NULL REFERENCES categories(id),
+            PRIMARY KEY (appid, cid)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS tags (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS game_tags (
+            appid INTEGER NOT NULL REFERENCES games(appid),
+            tid INTEGER NOT NULL REFERENCES tags(id),
+            PRIMARY KEY (appid, tid)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS developers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS game_developers (
+            appid INTEGER NOT NULL REFERENCES games(appid),
+            did INTEGER NOT NULL REFERENCES developers(id),
+            PRIMARY KEY (appid, did)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS publishers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS game_publishers (
+            appid INTEGER NOT NULL REFERENCES games(appid),
+            pid INTEGER NOT NULL REFERENCES publishers(id),
+            PRIMARY KEY (appid, pid)
+        )
+        """,
+    ]),
+    ("Catalog change log, user libraries, profiles and batch results", [
+        """
+        CREATE TABLE IF NOT EXISTS catalog_changes (
+            version INTEGER PRIMARY KEY AUTOINCREMENT,
+            appid INTEGER NOT NULL,
+            op TEXT NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS user_owned_games (
+            user_id TEXT NOT NULL,
+            appid INTEGER NOT NULL,
+            playtime INTEGER DEFAULT 0,
+            PRIMARY KEY (user_id, appid)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS user_sync (
+            user_id TEXT PRIMARY KEY,
+            synced_at REAL NOT NULL,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS user_profiles (
+            user_id TEXT PRIMARY KEY,
+            fingerprint TEXT NOT NULL,
+            profile TEXT NOT NULL,
+            updated_at REAL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS recommendation_generations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            started_at REAL NOT NULL,
+            finished_at REAL,
+            catalog_version INTEGER,
+            top INTEGER NOT NULL,
+            users INTEGER
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS user_recommendations (
+            user_id TEXT NOT NULL,
+            generation INTEGER NOT NULL,
+            sync_version INTEGER NOT NULL,
+            results TEXT NOT NULL,
+            PRIMARY KEY (user_id, generation)
+        )
+        """,
+    ]),
+    ("Reverse indexes of the game relations", [
+        # The primary keys lead with appid: finding the games of a tag,
+        # category, developer or publisher scanned the whole relation
+        "CREATE INDEX IF NOT EXISTS game_tags_tid ON game_tags (tid, appid)",
+        """
+        CREATE INDEX IF NOT EXISTS game_categories_cid
+        ON game_categories (cid, appid)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS game_developers_did
+        ON game_developers (did, appid)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS game_publishers_pid
+        ON game_publishers (pid, appid)
+        """,
+        # Pruning old batch generations
+        """
+        CREATE INDEX IF NOT EXISTS user_recommendations_generation
+        ON user_recommendations (generation)
+        """,
+        "ANALYZE",
+    ]),
+]
+
+
+# Tables indexed in item_search, and the kind of their rows there
+SEARCH_KINDS = {"tags": 1, "developers": 2, "publishers": 3}
+
+
+def _search_index():
+    """
+    Trigram full-text indexes (see search.py), kept in sync by triggers:
+        game_search: the name of every game, rowid = appid
+        item_search: the name of every tag, developer and publisher,
+            rowid = id * 4 + kind (SEARCH_KINDS)
+    """
+    statements = [
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS game_search
+        USING fts5(name, tokenize = 'trigram')
+        """,
+        "INSERT INTO game_search (rowid, name) SELECT appid, name FROM games",
+        # INSERT OR REPLACE into games does not fire the delete trigger, so
+        # an insert replaces the game's row itself
+        """
+        CREATE TRIGGER IF NOT EXISTS game_search_insert
+        AFTER INSERT ON games BEGIN
+            DELETE FROM game_search WHERE rowid = NEW.appid;
+            INSERT INTO game_search (rowid, name)
+            VALUES (NEW.appid, NEW.name);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS game_search_update
+        AFTER UPDATE OF name ON games BEGIN
+            UPDATE game_search SET name = NEW.name WHERE rowid = NEW.appid;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS game_search_delete
+        AFTER DELETE ON games BEGIN
+            DELETE FROM game_search WHERE rowid = OLD.appid;
+        END
+        """,
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS item_search
+        USING fts5(name, tokenize = 'trigram')
+        """,
+    ]
+    for table, kind in SEARCH_KINDS.items():
+        statements += [
+            f"""
+            INSERT INTO item_search (rowid, name)
+            SELECT id * 4 + {kind}, name FROM {table}
+            """,
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_search_insert
+            AFTER INSERT ON {table} BEGIN
+                DELETE FROM item_search WHERE rowid = NEW.id * 4 + {kind};
+                INSERT INTO item_search (rowid, name)
+                VALUES (NEW.id * 4 + {kind}, NEW.name);
+            END
+            """,
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_search_update
+            AFTER UPDATE OF name ON {table} BEGIN
+                UPDATE item_search SET name = NEW.name
+                WHERE rowid = NEW.id * 4 + {kind};
+            END
+            """,
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_search_delete
+            AFTER DELETE ON {table} BEGIN
+                DELETE FROM item_search WHERE rowid = OLD.id * 4 + {kind};
+            END
+            """,
+        ]
+    return statements
+
+
+MIGRATIONS.append(("Game search index", _search_index() + [
+    # Searches shorter than a trigram are name prefixes
+    "CREATE INDEX IF NOT EXISTS games_name ON games (name COLLATE NOCASE)",
+]))
+
+VERSION = len(MIGRATIONS)
+
+# (name, query, params) of the queries run on every request or ingest.
+# None of them may scan a whole table.
+HOT_QUERIES = [
+    ("games by tag (any)",
+     "SELECT DISTINCT appid FROM game_tags WHERE tid IN (?, ?)", (1, 2)),
+    ("games by tag (all)",
+     """
+     SELECT DISTINCT appid FROM game_tags WHERE tid IN (?, ?)
+     GROUP BY appid HAVING COUNT(DISTINCT tid) = ?
+     """, (1, 2, 2)),
+    ("games by category (any)",
+     "SELECT DISTINCT appid FROM game_categories WHERE cid IN (?, ?)",
+     (1, 2)),
+    ("games by category (all)",
+     """
+     SELECT DISTINCT appid FROM game_categories WHERE cid IN (?, ?)
+     GROUP BY appid HAVING COUNT(DISTINCT cid) = ?
+     """, (1, 2, 2)),
+    ("games by developer",
+     "SELECT appid FROM game_developers WHERE did = ?", (1,)),
+    ("games by publisher",
+     "SELECT appid FROM game_publishers WHERE pid = ?", (1,)),
+    ("game details",
+     """
+     SELECT g.appid, GROUP_CONCAT(DISTINCT c.name),
+            GROUP_CONCAT(DISTINCT t.name), GROUP_CONCAT(DISTINCT d.name),
+            GROUP_CONCAT(DISTINCT p.name)
+     FROM games g
+     LEFT JOIN game_categories gc ON g.appid = gc.appid
+     LEFT JOIN categories c ON gc.cid = c.id
+     LEFT JOIN game_tags gt ON g.appid = gt.appid
+     LEFT JOIN tags t ON gt.tid = t.id
+     LEFT JOIN game_developers gd ON g.appid = gd.appid
+     LEFT JOIN developers d ON gd.did = d.id
+     LEFT JOIN game_publishers gp ON g.appid = gp.appid
+     LEFT JOIN publishers p ON gp.pid = p.id
+     WHERE g.appid = ?
+     GROUP BY g.appid
+     """, (10,)),
+    ("names by appid",
+     """
+     SELECT g.appid, g.name FROM json_each(?) AS j
+     JOIN games g ON g.appid = j.value
+     """, ("[10, 20]",)),
+    ("games by name prefix",
+     """
+     SELECT appid FROM games
+     WHERE name >= ? COLLATE NOCASE AND name < ? COLLATE NOCASE
+     ORDER BY name COLLATE NOCASE LIMIT ?
+     """, ("ab", "ac", 20)),
+    ("games by name",
+     "SELECT rowid FROM game_search WHERE game_search MATCH ? LIMIT ?",
+     ('"quest"', 20)),
+    ("games by name (LIKE)",
+     "SELECT rowid FROM game_search WHERE name LIKE ? ORDER BY rowid LIMIT ?",
+     ("%quest%", 20)),
+    ("tags, developers and publishers by name",
+     "SELECT rowid, name FROM item_search WHERE item_search MATCH ? LIMIT ?",
+     ('"studio"', 50)),
+    ("games of a tag, by appid",
+     "SELECT appid FROM game_tags WHERE tid = ? ORDER BY appid LIMIT ?",
+     (1, 20)),
+    ("relations of a game",
+     "SELECT tid FROM game_tags WHERE appid = ?", (10,)),
+    ("relations of many games",
+     """
+     SELECT appid, tid FROM game_tags
+     WHERE appid IN (SELECT value FROM json_each(?))
+     ORDER BY appid, tid
+     """, ("[10, 20]",)),
+    ("user library",
+     "SELECT appid, playtime FROM user_owned_games WHERE user_id = ?",
+     ("1",)),
+    ("user sync state",
+     "SELECT synced_at, version FROM user_sync WHERE user_id = ?", ("1",)),
+    ("user profile",
+     "SELECT fingerprint, profile FROM user_profiles WHERE user_id = ?",
+     ("1",)),
+    ("catalog changes",
+     """
+     SELECT version, appid, op FROM catalog_changes
+     WHERE version > ? ORDER BY version
+     """, (0,)),
+    ("precomputed recommendations",
+     """
+     SELECT r.results, g.top
+     FROM user_recommendations r
+     JOIN recommendation_generations g ON g.id = r.generation
+     LEFT JOIN user_sync s ON s.user_id = r.user_id
+     WHERE r.user_id = ?
+       AND r.generation = (SELECT MAX(id) FROM recommendation_generations
+                           WHERE finished_at IS NOT NULL)
+       AND r.sync_version = COALESCE(s.version, 0)
+       AND g.catalog_version = (SELECT COALESCE(MAX(version), 0)
+                                FROM catalog_changes)
+     """, ("1",)),
+]
+
+
+def version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """
+    Apply every migration the database is missing, each in its own
+    transaction. Safe to run from several processes at once: the version
+    is read again once the write lock is held.
+
+    Params:
+        conn (sqlite3.Connection): Connection to the database
+
+    Returns:
+        int: Number of migrations applied
+    """
+    if version(conn) >= VERSION:
+        return 0
+
+    applied = 0
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            current = version(conn)
+            if current >= VERSION:
+                conn.rollback()
+                return applied
+
+            description, statements = MIGRATIONS[current]
+            for statement in statements:
+                conn.execute(statement)
+            # PRAGMA does not take parameters
+            conn.execute(f"PRAGMA user_version = {current + 1}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+        applied += 1
+        print(f"Migrated {current} -> {current + 1}: {description}")
+
+
+def table_scans(conn):
+    """
+    Query plan of every hot query
+
+    Returns:
+        (dict, list): {name: [plan lines]}, and the (name, line) of every
+            full table scan
+    """
+    plans, scans = {}, []
+    for name, query, params in HOT_QUERIES:
+        lines = [row[3] for row in
+                 conn.execute(f"EXPLAIN QUERY PLAN {query}", params)]
+        plans[name] = lines
+        for line in lines:
+            # json_each is a virtual table: scanning it reads the parameter
+            if line.startswith("SCAN ") and "VIRTUAL TABLE" not in line:
+                scans.append((name, line))
+    return plans, scans
+
+
+def main():
+    parser = argparse.ArgumentParser(
+            description="Migrate the games database to the latest schema")
+    parser.add_argument("--db", default=_filename)
+    parser.add_argument("--check", action="store_true",
+                        help="fail if a hot query scans a whole table")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    migrate(conn)
+    print(f"{args.db} is at version {version(conn)}")
+
+    if args.check:
+        plans, scans = table_scans(conn)
+        for name, lines in plans.items():
+            print(f"{name}:")
+            for line in lines:
+                print(f"    {line}")
+        for name, line in scans:
+            print(f"Table scan in {name}: {line}")
+        if scans:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import connections
+
+_filename = "steam_games.db"
+
+# In-memory tier limits
+MEMORY_CAPACITY = 1024  # profiles
+MEMORY_TTL = 15 * 60  # seconds
+
+
+def library_fingerprint(games, items=b""):
+    """
+    Digest of a user's library, used to tell whether a stored profile is
+    still valid.
+
+    Params:
+        games (dict): {appid: playtime}
+        items (bytes): Categories and tags of the owned games in the catalog
+            the profile is built from. Other catalog writes, such as prices
+            or games the user does not own, leave the profile as is.
+
+    Returns:
+        string: Hex digest, changes whenever an appid, a playtime or the
+            categories and tags of an owned game change
+    """
+    h = hashlib.sha1()
+    for appid, playtime in sorted(games.items()):
+        h.update(f"{appid}:{playtime or 0};".encode())
+    h.update(items)
+    return h.hexdigest()
+
+
+class ProfileStore:
+    """
+    Normalized tag/category profiles keyed by steamid.
+
+    Two tiers: a bounded LRU dict with a TTL in front of a sqlite table that
+    survives restarts and is shared by every process. A profile is only
+    returned if it was built from the library with the same fingerprint,
+    which covers the categories and tags of the owned games.
+    """
+
+    def __init__(self, filename, capacity=MEMORY_CAPACITY, ttl=MEMORY_TTL):
+        self.filename = filename
+        self.capacity = capacity
+        self.ttl = ttl
+        self._memory = OrderedDict()  # steamid -> (expires, fingerprint, profile)
+        self._lock = threading.Lock()
+
+    def get(self, steamid, fingerprint):
+        """
+        Fetch a user's profile
+
+        Params:
+            steamid: The user's steamid
+            fingerprint (string): library_fingerprint of the current library
+
+        Returns:
+            dict: The profile, or None if missing or built from another library
+        """
+        steamid = str(steamid)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._memory.get(steamid)
+            if entry is not None:
+                expires, stored_fingerprint, profile = entry
+                if expires > now and stored_fingerprint == fingerprint:
+                    self._memory.move_to_end(steamid)
+                    return profile
+                del self._memory[steamid]
+
+        with connections.read(self.filename) as conn:
+            cur = conn.cursor()
+            row = cur.execute("""
+                              SELECT fingerprint, profile FROM user_profiles
+                              WHERE user_id = ?
+                              """, (steamid,)).fetchone()
+
+        if row is None or row[0] != fingerprint:
+            return None
+
+        profile = json.loads(row[1])
+        self._remember(steamid, fingerprint, profile)
+        return profile
+
+    def put(self, steamid, fingerprint, profile):
+        # Store a profile in both tiers
+        steamid = str(steamid)
+        with connections.write(self.filename) as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                        INSERT OR REPLACE INTO user_profiles
+                            (user_id, fingerprint, profile, updated_at)
+                        VALUES (?, ?, ?, ?)
+                        """, (steamid, fingerprint, json.dumps(profile),
+                              time.time()))
+            conn.commit()
+
+        self._remember(steamid, fingerprint, profile)
+
+    def refresh(self, steamid, games, build, items=b""):
+        """
+        Make sure the stored profile matches a library, rebuilding it only
+        if the library, its playtimes or the owned games' categories and
+        tags changed.
+
+        Params:
+            steamid: The user's steamid
+            games (dict): {appid: playtime}
+            build (callable): build(steamid, appids) -> profile
+            items (bytes): See library_fingerprint
+
+        Returns:
+            dict: The profile
+        """
+        fingerprint = library_fingerprint(games, items)
+        profile = self.get(steamid, fingerprint)
+        if profile is None:
+            profile = build(steamid, list(games))
+            self.put(steamid, fingerprint, profile)
+        return profile
+
+    def evict(self, steamid):
+        # Drop a profile from the in-memory tier
+        with self._lock:
+            self._memory.pop(str(steamid), None)
+
+    def _remember(self, steamid, fingerprint, profile):
+        with self._lock:
+            self._memory[steamid] = (time.monotonic() + self.ttl,
+                                     fingerprint, profile)
+            self._memory.move_to_end(steamid)
+            while len(self._memory) > self.capacity:
+                self._memory.popitem(last=False)
+
+
+instance = ProfileStore(_filename)
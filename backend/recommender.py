@@ -1,7 +1,20 @@
-import sqlite3
-from collections import Counter
+import os
+import threading
+import time
 import math
+from collections import OrderedDict
+import numpy as np
+import connections
 import Db
+import events
+import instrumentation
+import profile_store
+import catalog_segment
+from catalog import Catalog
+from filters import FilterIndex
+from gems import GemIndex
+from similarity import SimilarityIndex
+from scoring import ScoringEngine
 
 DB_FILE = "steam_games.db"
 
@@ -9,60 +22,253 @@ DB_FILE = "steam_games.db"
 # LAZY-LOADED GAME CACHE
 # =========================================================
 
-GAME_CACHE = []
+GAME_CACHE = None
+ENGINE = None
 CACHE_LOADED = False
+GEM_INDEX = None
+FILTER_INDEX = None
+SIMILARITY_INDEX = None
+
+# Serving with several worker processes (see wsgi.py): the catalog is
+# mapped from a shared segment (see catalog_segment) instead of every
+# process holding its own copy
+SHARED_CATALOG = os.getenv("SHARED_CATALOG") == "1"
+_segment = None  # Name of the mapped segment
+# Patches are published as a new segment at most this often (seconds); the
+# process serves its private patched copy meanwhile, and the others patch
+# their own from the change log
+PUBLISH_DELAY = float(os.getenv("CATALOG_PUBLISH_DELAY", 5))
+_publish_timer = None
+
+# Similar-games index file, and the minimum time between two rebuilds
+# while the catalog keeps changing (a stale index is served meanwhile)
+SIMILARITY_FILE = os.getenv("SIMILARITY_INDEX_FILE", "similar_games.npz")
+SIMILARITY_REBUILD_INTERVAL = 10 * 60  # seconds
+_similarity_lock = threading.Lock()
+
+# Serializes loading and patching; readers never take it
+_cache_lock = threading.Lock()
+
+# Rankings kept per user, so that later pages are served without scoring
+# the catalog again. A ranking is dropped once the catalog or the user's
+# library changes.
+RANKING_CAPACITY = 256  # users
+RANKING_DEPTH = 100  # games ranked at least
+
+# steamid -> (engine, fingerprint, rows, scores, complete), complete being
+# True if rows holds every candidate
+_rankings = OrderedDict()
+_rankings_lock = threading.Lock()
 
 
 def load_all_games():
     """Load all games at once into memory for fast recommendation."""
-    global GAME_CACHE
-
-    with sqlite3.connect(DB_FILE) as conn:
-        cur = conn.cursor()
-        rows = cur.execute("""
-            SELECT
-                g.appid,
-                g.name,
-                g.price,
-                g.positive_reviews,
-                g.negative_reviews,
-                GROUP_CONCAT(DISTINCT c.name),
-                GROUP_CONCAT(DISTINCT t.name)
-            FROM games g
-            LEFT JOIN game_categories gc ON g.appid = gc.appid
-            LEFT JOIN categories c ON gc.cid = c.id
-            LEFT JOIN game_tags gt ON g.appid = gt.appid
-            LEFT JOIN tags t ON gt.tid = t.id
-            GROUP BY g.appid;
-        """).fetchall()
-
-    out = []
-
-    for row in rows:
-        appid = row[0]
-
-        categories = row[5].split(",") if row[5] else []
-        tags = row[6].split(",") if row[6] else []
-
-        out.append({
-            "appid": appid,
-            "name": row[1],
-            "price": row[2],
-            "positive_reviews": row[3] or 0,
-            "negative_reviews": row[4] or 0,
-            "categories": categories,
-            "tags": tags
-        })
-
-    GAME_CACHE = out
+    if SHARED_CATALOG:
+        name = catalog_segment.instance.current()
+        if name is not None and catalog_segment.instance.compatible(name):
+            _attach(name)
+            return
+
+    # Read the version first: a write racing with the load is re-applied
+    version = Db.instance.get_catalog_version()
+
+    with connections.read(DB_FILE) as conn:
+        catalog = Catalog.load(conn, version=version)
+
+    _swap_cache(catalog)
+
+
+def _swap_cache(catalog, changed=None):
+    # The catalog and its engine are replaced together, never modified.
+    # `changed` lists the appids patched since the current catalog, so the
+    # engine can update its statistics instead of recomputing them.
+    global GAME_CACHE, ENGINE, _segment
+    if SHARED_CATALOG:
+        if changed is None:
+            # Serve the mapped copy, not the private one just built
+            name = catalog_segment.instance.publish(catalog)
+            shared = catalog_segment.instance.open(name)
+            catalog, _segment = shared, name
+        else:
+            _schedule_publish()
+
+    ENGINE = ScoringEngine(catalog, previous=ENGINE, changed=changed)
+    GAME_CACHE = catalog
+
+
+def _schedule_publish():
+    # Publish the patched cache after PUBLISH_DELAY, so a burst of writes
+    # costs one segment. Called with _cache_lock held.
+    global _publish_timer
+    if _publish_timer is None or not _publish_timer.is_alive():
+        _publish_timer = threading.Timer(PUBLISH_DELAY, _publish_patches)
+        _publish_timer.daemon = True
+        _publish_timer.start()
+
+
+def _publish_patches():
+    # Share the patched cache with the other processes, then map it
+    try:
+        with _cache_lock:
+            name = catalog_segment.instance.publish(GAME_CACHE)
+            if name != _segment:
+                _attach(name)
+    except Exception as e:
+        print(f"Failed to publish the catalog: {e}")
+
+
+def _attach(name):
+    # Map a segment published by any process. The engine is updated from
+    # the current one with the changes logged in between, not rebuilt.
+    global GAME_CACHE, ENGINE, _segment
+    catalog = catalog_segment.instance.open(name)
+    changed = None
+    if ENGINE is not None and catalog.version >= GAME_CACHE.version:
+        changed = {appid for version, appid, _ in
+                   Db.instance.get_catalog_changes(GAME_CACHE.version)
+                   if version <= catalog.version}
+    ENGINE = ScoringEngine(catalog, previous=ENGINE, changed=changed)
+    GAME_CACHE, _segment = catalog, name
 
 
 def ensure_cache_loaded():
-    """Ensure we only load the DB after it exists & exactly once."""
+    """
+    Ensure we only load the DB after it exists & exactly once.
+    Afterwards, only catch up with writes made since (by any process).
+    """
     global CACHE_LOADED
+    if CACHE_LOADED:
+        if SHARED_CATALOG and catalog_segment.instance.current() != _segment:
+            with _cache_lock:
+                name = catalog_segment.instance.current()
+                # None once the segments were cleared
+                if (name is not None and name != _segment and
+                        catalog_segment.instance.compatible(name) and
+                        catalog_segment.instance.version_of(name) >=
+                        GAME_CACHE.version):
+                    _attach(name)
+        if Db.instance.get_catalog_version() > GAME_CACHE.version:
+            with _cache_lock:
+                sync_cache()
+        return
+
+    with _cache_lock:
+        if not CACHE_LOADED:
+            load_all_games()
+            CACHE_LOADED = True
+
+
+def sync_cache():
+    """Patch the cache with the games written since its version."""
+    changes = Db.instance.get_catalog_changes(GAME_CACHE.version)
+    if not changes:
+        return
+
+    appids = {appid for (_, appid, _) in changes}
+    with connections.read(DB_FILE) as conn:
+        catalog = GAME_CACHE.patched(conn, appids, changes[-1][0])
+
+    _swap_cache(catalog, appids)
+
+
+@events.subscribe
+def on_catalog_change(change):
+    """Apply a write made by this process without a full reload."""
     if not CACHE_LOADED:
-        load_all_games()
-        CACHE_LOADED = True
+        return
+
+    with _cache_lock:
+        if change.version <= GAME_CACHE.version:
+            return  # Already applied
+        if change.version > GAME_CACHE.version + 1:
+            # Another process wrote in between, catch up with everything
+            sync_cache()
+            return
+
+        if change.op == "price":
+            catalog = GAME_CACHE.with_price(change.appid, change.price,
+                                            change.version)
+        else:
+            with connections.read(DB_FILE) as conn:
+                catalog = GAME_CACHE.patched(conn, [change.appid],
+                                             change.version)
+
+        _swap_cache(catalog, [change.appid])
+
+
+def get_gem_index():
+    """Hidden gems of the game cache, rebuilt whenever the cache changes."""
+    global GEM_INDEX
+    ensure_cache_loaded()
+
+    catalog = GAME_CACHE
+    index = GEM_INDEX
+    if index is None or index.catalog is not catalog:
+        index = GemIndex(catalog)
+        GEM_INDEX = index
+    return index
+
+
+def get_filter_index():
+    """Filter bitmaps of the game cache, rebuilt whenever the cache changes."""
+    global FILTER_INDEX
+    ensure_cache_loaded()
+
+    catalog = GAME_CACHE
+    index = FILTER_INDEX
+    if index is None or index.catalog is not catalog:
+        index = FilterIndex(catalog, previous=index)
+        FILTER_INDEX = index
+    return index
+
+
+def get_similarity_index():
+    """
+    Similar-games index of the game cache.
+
+    Loaded from SIMILARITY_FILE, or built and saved if there is none: only
+    that first load waits. Once an index exists, an outdated one is rebuilt
+    in a background thread at most every SIMILARITY_REBUILD_INTERVAL and
+    served meanwhile.
+    """
+    global SIMILARITY_INDEX
+    ensure_cache_loaded()
+
+    catalog = GAME_CACHE
+    index = SIMILARITY_INDEX
+    if index is None:
+        # Nothing to serve yet: the first request loads or builds it
+        with _similarity_lock:
+            if SIMILARITY_INDEX is None:
+                index = SimilarityIndex.load(SIMILARITY_FILE)
+                if index is None:
+                    index = SimilarityIndex.build(catalog)
+                    index.save(SIMILARITY_FILE)
+                SIMILARITY_INDEX = index
+            index = SIMILARITY_INDEX
+
+    if (index.version == catalog.version or
+            time.time() - index.built_at < SIMILARITY_REBUILD_INTERVAL):
+        return index
+
+    # Serve the stale index, rebuild it in the background
+    if _similarity_lock.acquire(blocking=False):
+        threading.Thread(target=_rebuild_similarity_index, args=(catalog,),
+                         name="similarity-rebuild", daemon=True).start()
+    return index
+
+
+def _rebuild_similarity_index(catalog):
+    # Runs in its own thread, with _similarity_lock acquired by the caller
+    global SIMILARITY_INDEX
+    try:
+        index = SimilarityIndex.build(catalog)
+        index.save(SIMILARITY_FILE)
+        SIMILARITY_INDEX = index
+    except Exception as e:
+        print(f"Failed to rebuild the similarity index: {e}")
+    finally:
+        _similarity_lock.release()
 
 
 # =========================================================
@@ -70,7 +276,7 @@ def ensure_cache_loaded():
 # =========================================================
 
 def get_user_owned(steamid):
-    with sqlite3.connect(DB_FILE) as conn:
+    with connections.read(DB_FILE) as conn:
         cur = conn.cursor()
         rows = cur.execute("""
             SELECT appid
@@ -80,6 +286,18 @@ def get_user_owned(steamid):
     return [appid for (appid,) in rows]
 
 
+def get_user_library(steamid):
+    # {appid: playtime} of every game the user owns
+    with connections.read(DB_FILE) as conn:
+        cur = conn.cursor()
+        rows = cur.execute("""
+            SELECT appid, playtime
+            FROM user_owned_games
+            WHERE user_id = ?
+        """, (str(steamid),)).fetchall()
+    return dict(rows)
+
+
 # =========================================================
 # REVIEW CONFIDENCE
 # =========================================================
@@ -102,29 +320,72 @@ def wilson_score(pos, neg):
 # USER PROFILE
 # =========================================================
 
-def build_profile(steamid):
-    owned = get_user_owned(steamid)
+def build_profile(steamid, owned=None, catalog=None):
+    """
+    Share of every category and tag among the user's owned games.
 
-    cat_counter = Counter()
-    tag_counter = Counter()
+    Computed from the in-memory catalog with one pass over the owned rows,
+    so the cost barely depends on the size of the library.
 
-    for appid in owned:
-        g = Db.instance.get_app_details(appid)
-        if not g:
-            continue
+    Params:
+        steamid: The user's steamid
+        owned (list[int]): The user's appids, read from the DB if omitted
+        catalog (Catalog): Catalog to use, the game cache if omitted
+    """
+    if catalog is None:
+        ensure_cache_loaded()
+        catalog = GAME_CACHE
+    if owned is None:
+        owned = get_user_owned(steamid)
 
-        cat_counter.update(g["categories"])
-        tag_counter.update(g["tags"])
+    rows = catalog.rows_of(owned)
 
-    total_cat = sum(cat_counter.values()) or 1
-    total_tag = sum(tag_counter.values()) or 1
+    return {
+        "categories": _item_shares(catalog.categories, rows),
+        "tags": _item_shares(catalog.tags, rows),
+    }
 
-    profile_cats = {k: v / total_cat for k, v in cat_counter.items()}
-    profile_tags = {k: v / total_tag for k, v in tag_counter.items()}
 
+def get_profile(steamid, games=None, catalog=None):
+    """
+    The user's profile from the profile store, rebuilt only if their
+    library, their playtimes or the categories and tags of their games
+    changed since it was stored.
+
+    Params:
+        steamid: The user's steamid
+        games (dict): {appid: playtime}, read from the DB if omitted
+        catalog (Catalog): Catalog to use, the game cache if omitted
+    """
+    if catalog is None:
+        ensure_cache_loaded()
+        catalog = GAME_CACHE
+    if games is None:
+        games = get_user_library(steamid)
+
+    return profile_store.instance.refresh(
+            steamid, games,
+            lambda steamid, owned: build_profile(steamid, owned, catalog),
+            owned_items(catalog, games))
+
+
+def owned_items(catalog, games):
+    # Owned games in the catalog with their category and tag ids: all of the
+    # catalog a profile is built from
+    rows = catalog.rows_of(games)
+    parts = [catalog.appids[rows].tobytes()]
+    for index in (catalog.categories, catalog.tags):
+        owned = index.take(rows)
+        parts += [owned.indptr.tobytes(), index.ids[owned.indices].tobytes()]
+    return b"|".join(parts)
+
+
+def _item_shares(index, rows):
+    counts = index.counts(rows)
+    total = int(counts.sum()) or 1
     return {
-        "categories": profile_cats,
-        "tags": profile_tags,
+        index.names[c]: int(counts[c]) / total
+        for c in np.flatnonzero(counts)
     }
 
 
@@ -163,31 +424,97 @@ def compute_score(profile, game):
 # MAIN RECOMMENDER
 # =========================================================
 
-def recommend_for_user(steamid, limit=10):
+def recommend_for_user(steamid, limit=10, offset=0):
+    """
+    Best games for a user that they do not own
+
+    Params:
+        steamid: The user's steamid
+        limit (int): Number of games to return
+        offset (int): Number of best games to skip, for pagination
+
+    Returns:
+        list[dict]: {appid, name, price, tags, score}, best first
+    """
 
     # Load the DB cache only when needed
-    ensure_cache_loaded()
+    with instrumentation.span("recommender.cache_load"):
+        ensure_cache_loaded()
+
+    # The cache may be swapped by a write while we are scoring
+    engine = ENGINE
+
+    with instrumentation.span("recommender.library"):
+        games = get_user_library(steamid)
+    rows, scores = get_ranking(steamid, games, engine, offset + limit)
 
-    profile = build_profile(steamid)
-    owned = set(get_user_owned(steamid))
+    with instrumentation.span("recommender.format"):
+        return format_results(engine.catalog, rows[offset:offset + limit],
+                              scores[offset:offset + limit])
 
-    # Exclude owned games
-    candidates = [
-        g for g in GAME_CACHE
-        if g["appid"] not in owned
-    ]
 
-    scored = []
+def format_results(catalog, rows, scores):
+    # Output dicts of ranked catalog rows
+    results = []
 
-    for g in candidates:
-        score = compute_score(profile, g)
-        scored.append({
+    for i, score in zip(rows, scores):
+        g = catalog[i]
+        results.append({
             "appid": g["appid"],
             "name": g["name"],
             "price": g["price"],
             "tags": g["tags"],
-            "score": round(score, 4)
+            "score": round(float(score), 4)
         })
 
-    scored.sort(key=lambda x: x["score"], reverse=True)
-    return scored[:limit]
+    return results
+
+
+def get_ranking(steamid, games, engine, depth):
+    """
+    The user's best unowned games, scored once and kept for later pages.
+
+    Only the top rows are kept (see ScoringEngine.top_k), never the score of
+    every game. A request going deeper than the kept ranking scores again.
+
+    Params:
+        steamid: The user's steamid
+        games (dict): The user's library, {appid: playtime}
+        engine (ScoringEngine): Engine of the catalog to rank
+        depth (int): Number of ranked games needed
+
+    Returns:
+        (np.ndarray, np.ndarray): Catalog rows, best first, and their scores
+    """
+    steamid = str(steamid)
+    fingerprint = profile_store.library_fingerprint(games)
+
+    with _rankings_lock:
+        entry = _rankings.get(steamid)
+        if (entry is not None and entry[0] is engine and
+                entry[1] == fingerprint and
+                (len(entry[2]) >= depth or entry[4])):
+            _rankings.move_to_end(steamid)
+            return entry[2], entry[3]
+
+    depth = max(depth, RANKING_DEPTH)
+    with instrumentation.span("recommender.profile"):
+        profile = get_profile(steamid, games, engine.catalog)
+
+    with instrumentation.span("recommender.score"):
+        # Exclude owned games
+        exclude = engine.owned_mask(list(games))
+        scores = engine.score(profile)
+
+    with instrumentation.span("recommender.sort"):
+        rows = engine.top_k(scores, depth, exclude)
+        scores = scores[rows]
+
+    with _rankings_lock:
+        _rankings[steamid] = (engine, fingerprint, rows, scores,
+                              len(rows) < depth)
+        _rankings.move_to_end(steamid)
+        while len(_rankings) > RANKING_CAPACITY:
+            _rankings.popitem(last=False)
+
+    return rows, scores
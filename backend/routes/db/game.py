@@ -1,10 +1,20 @@
 from flask import Flask, jsonify, request
 from flask_cors import CORS
 import Db
+import http_cache
 from flask_app import app
 
 
+def _key():
+    # Invalid appids are answered by the view
+    appid = request.args.get("appid", type=int)
+    if appid is None:
+        return None
+    return [appid, Db.instance.get_catalog_version()]
+
+
 @app.route("/db/game")
+@http_cache.cached(_key)
 def db_game():
     # Usage: http://localhost:5000/db/game?appid=X
     try:
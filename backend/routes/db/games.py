@@ -0,0 +1,45 @@
+from flask import jsonify, request
+import Db
+from flask_app import app
+
+# Appids resolved per request
+MAX_BATCH = 1000
+
+
+@app.route("/db/games", methods=["GET", "POST"])
+def db_games():
+    # Usage: http://localhost:5000/db/games?appids=X,Y,Z
+    #    or: POST /db/games with {"appids": [X, Y, Z]}
+    if request.method == "POST":
+        data = request.get_json(silent=True)
+        appids = data.get("appids") if isinstance(data, dict) else None
+        if not isinstance(appids, list):
+            return jsonify({"error": "Missing 'appids' list in JSON"}), 400
+    else:
+        appids = request.args.get("appids")
+        if not appids:
+            return jsonify({"error": "Missing appids"}), 400
+        appids = appids.split(",")
+
+    try:
+        appids = [int(appid) for appid in appids]
+    except (ValueError, TypeError):
+        return jsonify({"error": "Invalid appid"}), 400
+    if len(appids) > MAX_BATCH:
+        return jsonify({"error": f"At most {MAX_BATCH} appids per request"}), 400
+
+    details = Db.instance.get_app_details_many(appids)
+
+    # In the order requested, each game once
+    games, missing = [], []
+    seen = set()
+    for appid in appids:
+        if appid in seen:
+            continue
+        seen.add(appid)
+        if appid in details:
+            games.append(details[appid])
+        else:
+            missing.append(appid)
+
+    return jsonify({"games": games, "missing": missing})
@@ -0,0 +1,70 @@
+from flask import jsonify, request
+import recommender
+from catalog import CONTROLLER_SUPPORT, PLATFORMS
+from flask_app import app
+
+# Games returned per page
+MAX_LIMIT = 100
+
+
+def _list(name, convert=str):
+    # Comma-separated query parameter
+    value = request.args.get(name, "")
+    return [convert(v) for v in value.split(",") if v.strip()]
+
+
+def _price(name):
+    value = request.args.get(name)
+    return None if value is None else float(value)
+
+
+@app.route("/filter", methods=["GET"])
+def filter_games():
+    # Usage: http://localhost:5000/filter?tags=1,2&categories=3&match=all
+    #     &min_price=0&max_price=999&platforms=mac,linux
+    #     &controller=partial,full&limit=20&offset=0
+    try:
+        tags = _list("tags", int)
+        categories = _list("categories", int)
+        min_price, max_price = _price("min_price"), _price("max_price")
+        limit = int(request.args.get("limit", 20))
+        offset = int(request.args.get("offset", 0))
+    except ValueError:
+        return jsonify({"error": "tags, categories, prices, limit and "
+                                 "offset must be numbers"}), 400
+    if limit < 0 or offset < 0:
+        return jsonify({"error": "limit and offset must not be negative"}), 400
+    limit = min(limit, MAX_LIMIT)
+
+    match = request.args.get("match", "all")
+    if match not in ("all", "any"):
+        return jsonify({"error": "match must be 'all' or 'any'"}), 400
+
+    platforms = _list("platforms")
+    controller = _list("controller")
+    unknown = ([p for p in platforms if p not in PLATFORMS] +
+               [c for c in controller if c not in CONTROLLER_SUPPORT])
+    if unknown:
+        return jsonify({"error": f"Unknown filter values: {unknown}"}), 400
+
+    index = recommender.get_filter_index()
+    bitmap = index.filter(tags, categories, match == "all",
+                          min_price, max_price, platforms, controller)
+    rows = index.top(bitmap, limit, offset)
+
+    catalog = index.catalog
+    games = []
+    for i in rows:
+        g = catalog[i]
+        games.append({
+            "appid": g["appid"],
+            "name": g["name"],
+            "price": g["price"],
+            "tags": g["tags"],
+        })
+
+    return jsonify({
+        "total": index.count(bitmap),
+        "games": games,
+        "facets": index.facets(bitmap),
+    })
@@ -0,0 +1,50 @@
+from flask import jsonify, request
+import appdetails_cache
+import http_cache
+import instrumentation
+import scheduler
+from flask_app import app
+
+
+@app.route("/metrics/upstream", methods=["GET"])
+def upstream_metrics():
+    # Queue depth, current rate and wait times of every upstream endpoint
+    return jsonify(scheduler.instance.metrics())
+
+
+@app.route("/metrics/appdetails-cache", methods=["GET"])
+def appdetails_cache_metrics():
+    # Hit/miss counters of the on-disk appdetails cache
+    return jsonify(appdetails_cache.instance.stats())
+
+
+@app.route("/metrics/http-cache", methods=["GET"])
+def http_cache_metrics():
+    # Hit/miss counters and size of the response cache
+    return jsonify(http_cache.instance.stats())
+
+
+@app.route("/metrics/latency", methods=["GET"])
+def latency_metrics():
+    # Latency histograms of every route and span of this worker
+    return jsonify(instrumentation.histograms())
+
+
+@app.route("/metrics/profile", methods=["GET", "POST"])
+def profile_metrics():
+    # Usage: GET /metrics/profile?limit=N for the most sampled stacks,
+    #        POST {"enabled": true|false, "reset": true} to toggle
+    if request.method == "POST":
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({"error": "Missing JSON body"}), 400
+        if data.get("reset"):
+            instrumentation.profiler.reset()
+        if "enabled" in data:
+            if data["enabled"]:
+                instrumentation.profiler.start()
+            else:
+                instrumentation.profiler.stop()
+
+    limit = request.args.get("limit", 100, type=int)
+    return jsonify(instrumentation.profiler.report(limit))
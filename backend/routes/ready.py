@@ -0,0 +1,10 @@
+from flask import jsonify
+import warmup
+from flask_app import app
+
+
+@app.route("/ready", methods=["GET"])
+def ready():
+    # 200 once the game cache is loaded, 503 while it is still warming up
+    state = warmup.state()
+    return jsonify(state), 200 if state["status"] == "ready" else 503
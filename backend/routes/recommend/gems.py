@@ -1,11 +1,26 @@
 from flask import jsonify, request
 import Db
-import SteamWebAPI as swa
+import http_cache
+import instrumentation
+import recommender
+import user_library
 from flask_app import app
-import math
+
+
+def _key():
+    try:
+        steamid = int(request.args.get("steamid"))
+    except (ValueError, TypeError):
+        return None
+    # None until the library is stored: the view fetches it
+    version = user_library.get_library_version(steamid)
+    if version is None:
+        return None
+    return [steamid, version, Db.instance.get_catalog_version()]
 
 
 @app.route("/recommend/hidden-gems", methods=["GET"])
+@http_cache.cached(_key)
 def hidden_gems():
     # Usage: http://localhost:5000/recommend/hidden-gems?steamid=id
     steamid = request.args.get("steamid")
@@ -16,51 +31,16 @@ def hidden_gems():
     except ValueError:
         return jsonify({"error": "The steamid provided is invalid"}), 400
 
-    # Find all hidden gems
-    candidates = Db.instance.custom_query(
-            """
-            SELECT appid, positive_reviews, total_reviews
-            FROM games
-            WHERE total_reviews < 500 AND total_reviews > 50;
-            """
-            )
-    gems = []
-    for c in candidates:
-        if (c[1] / c[2]) > 0.9:
-            gems.append(c[0])
-
-    # Get tag names
-    tag_weights = {}
-    tag_names = Db.instance.custom_query('SELECT name FROM tags')
-    for name in tag_names:
-        tag_weights[name[0]] = 0
-
-    # Get user's games
-    user_games = swa.instance.GetOwnedGames(steamid)
-    if not user_games:
+    # Get user's games, as stored by the last sync
+    u_games = user_library.get_library(steamid)
+    if u_games is None:
         return jsonify({"error": "Unable to fetch user data"}), 400
-    u_games = user_games.get("games", {})
 
-    # Calculate tag weights
-    for appid in u_games:
-        playtime_hrs = u_games[appid] / 60
-        game = Db.instance.get_app_details(appid)
-        if not game:
-            continue
-        for tag in game["tags"]:
-            tag_weights[tag] += math.log(1 + playtime_hrs)
+    # Score every hidden gem against the user's playtime per tag
+    with instrumentation.span("recommender.gems"):
+        top_50 = recommender.get_gem_index().top(u_games, 50)
 
-    # Score each gem
-    scores = {}
-    for appid in gems:
-        game = Db.instance.get_app_details(appid)
-        if not game:
-            continue
-        score = 0
-        for tag in game["tags"]:
-            score += tag_weights[tag]
-        scores[appid] = (score, game)
-    top_50 = sorted(scores.items(), key=lambda x: x[1][0], reverse=True)[:50]
-    top_50 = [t[1][1] for t in top_50]
+    games = Db.instance.get_app_details_many(top_50)
+    results = [games[appid] for appid in top_50 if appid in games]
 
-    return jsonify(top_50)
+    return jsonify(results)
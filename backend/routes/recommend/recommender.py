@@ -1,9 +1,35 @@
 from flask import Blueprint, request, jsonify
+import Db
+import http_cache
+import user_library
 from recommender import recommend_for_user
+from batch_recommend import get_precomputed, latest_generation
 
 recommend_bp = Blueprint("recommend", __name__)
 
+# Games per page, and deepest game a page may reach
+MAX_LIMIT = 100
+MAX_DEPTH = 1000
+
+
+def _key():
+    steamid = request.args.get("steamid")
+    try:
+        limit = int(request.args.get("limit", 10))
+        offset = int(request.args.get("offset", 0))
+    except ValueError:
+        return None
+    if (not steamid or limit < 0 or offset < 0 or limit > MAX_LIMIT or
+            offset + limit > MAX_DEPTH):
+        return None
+    # The stored library is scored as is, never synced here
+    _, version = user_library.get_sync_state(steamid)
+    return [steamid, limit, offset, version,
+            Db.instance.get_catalog_version(), latest_generation()]
+
+
 @recommend_bp.route("/recommend", methods=["GET"])
+@http_cache.cached(_key)
 def recommend():
     steamid = request.args.get("steamid")
 
@@ -11,7 +37,23 @@ def recommend():
         return jsonify({"error": "Missing steamid"}), 400
 
     try:
-        results = recommend_for_user(steamid)
+        limit = int(request.args.get("limit", 10))
+        offset = int(request.args.get("offset", 0))
+    except ValueError:
+        return jsonify({"error": "limit and offset must be integers"}), 400
+    if limit < 0 or offset < 0:
+        return jsonify({"error": "limit and offset must not be negative"}), 400
+    if limit > MAX_LIMIT:
+        return jsonify({"error": f"limit must be at most {MAX_LIMIT}"}), 400
+    if offset + limit > MAX_DEPTH:
+        return jsonify({"error": f"offset + limit must be at most "
+                                 f"{MAX_DEPTH}"}), 400
+
+    try:
+        # Lists precomputed by batch_recommend, else scored now
+        results = get_precomputed(steamid, offset, limit)
+        if results is None:
+            results = recommend_for_user(steamid, limit, offset)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
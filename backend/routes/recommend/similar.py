@@ -0,0 +1,40 @@
+from flask import jsonify, request
+import recommender
+from flask_app import app
+
+# Games returned per request
+MAX_LIMIT = 100
+
+
+@app.route("/recommend/similar", methods=["GET"])
+def similar_games():
+    # Usage: http://localhost:5000/recommend/similar?appid=id&limit=10
+    try:
+        appid = int(request.args.get("appid", ""))
+        limit = int(request.args.get("limit", 10))
+    except ValueError:
+        return jsonify({"error": "appid and limit must be integers"}), 400
+    if limit < 0:
+        return jsonify({"error": "limit must not be negative"}), 400
+    if limit > MAX_LIMIT:
+        return jsonify({"error": f"limit must be at most {MAX_LIMIT}"}), 400
+
+    neighbours = recommender.get_similarity_index().neighbours(appid, limit)
+    if neighbours is None:
+        return jsonify({"error": f"Unknown appid {appid}"}), 404
+
+    catalog = recommender.GAME_CACHE
+    results = []
+    for other, similarity in neighbours:
+        g = catalog.get(other)
+        if g is None:
+            continue  # Deleted since the index was built
+        results.append({
+            "appid": g["appid"],
+            "name": g["name"],
+            "price": g["price"],
+            "tags": g["tags"],
+            "similarity": round(similarity, 4)
+        })
+
+    return jsonify(results)
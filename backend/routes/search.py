@@ -0,0 +1,23 @@
+from flask import jsonify, request
+import search
+from flask_app import app
+
+
+@app.route("/search", methods=["GET"])
+def search_games():
+    # Usage: http://localhost:5000/search?q=text&limit=20&offset=0
+    query = request.args.get("q", "")
+    if not query.strip():
+        return jsonify({"error": "Missing q"}), 400
+
+    try:
+        limit = int(request.args.get("limit", 20))
+        offset = int(request.args.get("offset", 0))
+    except ValueError:
+        return jsonify({"error": "limit and offset must be integers"}), 400
+    if limit < 0 or offset < 0:
+        return jsonify({"error": "limit and offset must not be negative"}), 400
+    if limit > search.MAX_LIMIT:
+        return jsonify({"error": f"limit must be at most {search.MAX_LIMIT}"}), 400
+
+    return jsonify(search.search(query, limit, offset))
@@ -0,0 +1,190 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+
+# Priorities, lower runs first
+INTERACTIVE = 0  # A user is waiting on the answer (/sync_user, /db/insert)
+BACKGROUND = 10  # Catalog ingestion and refreshes
+
+# Default limits per upstream endpoint: (requests per second, burst)
+LIMITS = {
+    "store": (200 / 300, 10),  # ~200 appdetails requests per 5 minutes
+    "steamspy": (1.0, 1),  # 1 appdetails request per second
+    "webapi": (1.0, 10),  # ~100k calls per day, short bursts allowed
+}
+
+# Processes calling the upstreams at the same time. Every process has its
+# own scheduler, so each one gets an equal share of every limit: with N
+# gunicorn workers the host as a whole stays within LIMITS. A one-off
+# process (ingest.py) next to the server is not accounted for.
+PROCESSES = max(1, int(os.getenv("WEB_CONCURRENCY", 1)))
+
+# Adaptive slow-down: on 429/5xx the rate is multiplied by SLOWDOWN, down to
+# MIN_RATE_FACTOR * limit. Every success gives back RECOVERY * limit.
+SLOWDOWN = 0.5
+MIN_RATE_FACTOR = 0.05
+RECOVERY = 0.05
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.limit = rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self):
+        """
+        Take a token if one is available
+
+        Returns:
+            float: 0 if a token was taken, else seconds until one is
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def slow_down(self):
+        self.rate = max(self.limit * MIN_RATE_FACTOR, self.rate * SLOWDOWN)
+        self.tokens = min(self.tokens, 0)
+
+    def recover(self):
+        self.rate = min(self.limit, self.rate + self.limit * RECOVERY)
+
+
+class Endpoint:
+    # Token bucket, waiting queue and metrics of one upstream endpoint
+    def __init__(self, rate, burst):
+        self.bucket = TokenBucket(rate, burst)
+        self.cond = threading.Condition()
+        self.queue = []  # heap of (priority, seq)
+        self.requests = 0
+        self.throttled = 0  # 429/5xx answers
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+
+class Scheduler:
+    """
+    Gate for every outbound call to a rate-limited upstream.
+
+    Each endpoint has a token bucket. Callers wait in a priority queue, so
+    an interactive request waiting for a token is served before every
+    background request queued on the same endpoint. When the upstream
+    answers 429 or 5xx the endpoint's rate is cut, then recovers
+    gradually with every successful answer.
+    """
+
+    def __init__(self, limits=LIMITS):
+        self._endpoints = {name: Endpoint(rate, burst)
+                           for name, (rate, burst) in limits.items()}
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def _endpoint(self, name):
+        with self._lock:
+            endpoint = self._endpoints.get(name)
+            if endpoint is None:
+                raise ValueError(f"Unknown endpoint: {name}")
+            return endpoint
+
+    def set_limit(self, name, rate, burst=1):
+        # Change (or add) the limit of an endpoint
+        with self._lock:
+            endpoint = self._endpoints.get(name)
+            if endpoint is None:
+                self._endpoints[name] = Endpoint(rate, burst)
+                return
+        with endpoint.cond:
+            endpoint.bucket = TokenBucket(rate, burst)
+            endpoint.cond.notify_all()
+
+    def acquire(self, name, priority=BACKGROUND):
+        """
+        Block until a request to an endpoint may be sent
+
+        Params:
+            name (string): Endpoint, one of the keys of LIMITS
+            priority (int): INTERACTIVE or BACKGROUND
+
+        Returns:
+            float: Seconds spent waiting
+        """
+        endpoint = self._endpoint(name)
+        entry = (priority, next(self._seq))
+        start = time.monotonic()
+
+        with endpoint.cond:
+            heapq.heappush(endpoint.queue, entry)
+            # A new head may have arrived, let the current one re-check
+            endpoint.cond.notify_all()
+            while True:
+                if endpoint.queue[0] == entry:
+                    delay = endpoint.bucket.take()
+                    if delay == 0:
+                        heapq.heappop(endpoint.queue)
+                        endpoint.cond.notify_all()
+                        break
+                    endpoint.cond.wait(delay)
+                else:
+                    endpoint.cond.wait()
+
+            waited = time.monotonic() - start
+            endpoint.requests += 1
+            endpoint.wait_total += waited
+            endpoint.wait_max = max(endpoint.wait_max, waited)
+        return waited
+
+    def report(self, name, status):
+        """
+        Feed back the status of an answer (None if no answer came back)
+        so the endpoint's rate can adapt.
+        """
+        endpoint = self._endpoint(name)
+        with endpoint.cond:
+            if status is None or status == 429 or status >= 500:
+                endpoint.throttled += 1
+                endpoint.bucket.slow_down()
+            else:
+                endpoint.bucket.recover()
+
+    def metrics(self):
+        """
+        Returns:
+            dict: {endpoint: {queue_depth, rate, limit, requests, throttled,
+                              wait_avg, wait_max}}
+        """
+        with self._lock:
+            endpoints = dict(self._endpoints)
+
+        out = {}
+        for name, endpoint in endpoints.items():
+            with endpoint.cond:
+                out[name] = {
+                    "queue_depth": len(endpoint.queue),
+                    "rate": endpoint.bucket.rate,
+                    "limit": endpoint.bucket.limit,
+                    "requests": endpoint.requests,
+                    "throttled": endpoint.throttled,
+                    "wait_avg": (endpoint.wait_total / endpoint.requests
+                                 if endpoint.requests else 0.0),
+                    "wait_max": endpoint.wait_max,
+                }
+        return out
+
+
+def shared_limits(limits=LIMITS, processes=PROCESSES):
+    # Each process' share of the limits, at least one request of burst
+    return {name: (rate / processes, max(1, burst // processes))
+            for name, (rate, burst) in limits.items()}
+
+
+instance = Scheduler(shared_limits())
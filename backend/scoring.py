@@ -0,0 +1,245 @@
+import os
+import numpy as np
+
+# Weights of the recommendation score, see recommender.compute_score
+CATEGORY_WEIGHT = 0.40
+TAG_WEIGHT = 0.50
+REVIEW_WEIGHT = 0.10
+
+# How tags and categories are weighted:
+#   "shares": every tag of a game counts fully (recommender.compute_score)
+#   "idf": game and profile vectors are IDF-weighted and L2-normalized, so
+#          tags most games have (Indie, Singleplayer...) count less
+WEIGHTING = os.getenv("SCORING_WEIGHTING", "shares")
+
+
+def wilson_scores(pos, neg):
+    """
+    Vectorized version of recommender.wilson_score
+
+    Params:
+        pos (np.ndarray): Positive review counts
+        neg (np.ndarray): Negative review counts
+
+    Returns:
+        np.ndarray: Lower bound of the 95% Wilson interval for every game
+    """
+    pos = np.asarray(pos, dtype=np.float64)
+    n = pos + np.asarray(neg, dtype=np.float64)
+    z = 1.96
+
+    out = np.zeros(len(n), dtype=np.float64)
+    nz = n > 0
+    n = n[nz]
+    phat = pos[nz] / n
+    out[nz] = (
+        (phat + z*z/(2*n) - z * np.sqrt((phat*(1-phat) + z*z/(4*n))/n))
+        / (1 + z*z/n)
+    )
+    return out
+
+
+class IdfVectors:
+    """
+    IDF-weighted, L2-normalized game vectors of one catalog index (tags or
+    categories), with the document frequencies they were derived from.
+
+    values[j] is the weight of the entry index.indices[j].
+    """
+
+    def __init__(self, index, rows, df):
+        self.df = df
+        self.games = len(index.indptr) - 1
+        self.idf = np.log((1 + self.games) / (1 + df)) + 1
+
+        weights = self.idf[index.indices]
+        norms = np.sqrt(np.bincount(rows, weights=weights * weights,
+                                    minlength=self.games))
+        self.values = (weights / norms[rows]).astype(np.float32)
+
+    @classmethod
+    def build(cls, index, rows):
+        # Document frequency of every item: number of games having it
+        df = np.bincount(index.indices, minlength=len(index))
+        return cls(index, rows, df)
+
+    def updated(self, old_index, old_rows, index, rows, new_rows):
+        """
+        Vectors of a patched index, updating the document frequencies with
+        the changed games only
+
+        Params:
+            old_index (CsrIndex): The index these vectors were built from
+            old_rows (np.ndarray): Rows of the changed games in old_index
+            index (CsrIndex): The patched index
+            rows (np.ndarray): Row number of every entry of index
+            new_rows (np.ndarray): Rows of the changed games in index
+        """
+        df = self.df - old_index.counts(old_rows)
+        if not np.array_equal(old_index.ids, index.ids):
+            # New items were added to the vocabulary
+            grown = np.zeros(len(index), dtype=df.dtype)
+            grown[np.searchsorted(index.ids, old_index.ids)] = df
+            df = grown
+        return IdfVectors(index, rows, df + index.counts(new_rows))
+
+
+class ScoringEngine:
+    """
+    Scores every game of the catalog against a user profile at once.
+
+    Built once from the catalog; uses its game x tag and game x category
+    matrices and precomputes the Wilson score of every game so that a
+    request only costs two sparse matrix-vector products. With the "idf"
+    weighting the game vectors are precomputed as well (see IdfVectors).
+
+    An engine built for a patched catalog can start from the previous
+    engine: the document frequencies are then updated from the changed
+    games instead of recounted.
+    """
+
+    def __init__(self, catalog, weighting=None, previous=None, changed=None):
+        """
+        Params:
+            catalog (Catalog): Games to score
+            weighting (string): "shares" or "idf", defaults to WEIGHTING
+            previous (ScoringEngine): Engine of the catalog this one was
+                patched from
+            changed (iterable[int]): appids patched since previous
+        """
+        if changed is not None:
+            changed = list(changed)
+        self.catalog = catalog
+        self.appids = catalog.appids
+        self.weighting = weighting or WEIGHTING
+        self.wilson = self._wilson(previous, changed)
+        # Catalog row number of every stored tag/category entry
+        self.category_rows = catalog.categories.row_ids()
+        self.tag_rows = catalog.tags.row_ids()
+
+        self.category_vectors = self.tag_vectors = None
+        if self.weighting == "idf":
+            if (previous is None or changed is None or
+                    previous.weighting != "idf"):
+                self.category_vectors = IdfVectors.build(
+                        catalog.categories, self.category_rows)
+                self.tag_vectors = IdfVectors.build(catalog.tags,
+                                                    self.tag_rows)
+            else:
+                self.category_vectors = self._updated(
+                        previous, changed, "categories", self.category_rows,
+                        previous.category_vectors)
+                self.tag_vectors = self._updated(
+                        previous, changed, "tags", self.tag_rows,
+                        previous.tag_vectors)
+
+    def _wilson(self, previous, changed):
+        # Wilson score of every game, only recomputed for the changed games
+        # if the rows are the same as in the previous engine
+        catalog = self.catalog
+        if (previous is None or changed is None or
+                not np.array_equal(previous.appids, self.appids)):
+            return wilson_scores(catalog.positive_reviews,
+                                 catalog.negative_reviews)
+        rows = catalog.rows_of(changed)
+        wilson = previous.wilson.copy()
+        wilson[rows] = wilson_scores(catalog.positive_reviews[rows],
+                                     catalog.negative_reviews[rows])
+        return wilson
+
+    def _updated(self, previous, changed, name, rows, vectors):
+        old_index = getattr(previous.catalog, name)
+        index = getattr(self.catalog, name)
+        if index is old_index:
+            return vectors  # Only prices changed
+        return vectors.updated(old_index, previous.catalog.rows_of(changed),
+                               index, rows, self.catalog.rows_of(changed))
+
+    def __len__(self):
+        return len(self.appids)
+
+    def score(self, profile):
+        """
+        Score every game of the catalog
+
+        Params:
+            profile (dict): Output of recommender.build_profile
+
+        Returns:
+            np.ndarray: Score of every game, in catalog order
+        """
+        category_score = self._dot(self.catalog.categories, self.category_rows,
+                                   profile["categories"],
+                                   self.category_vectors)
+        tag_score = self._dot(self.catalog.tags, self.tag_rows,
+                              profile["tags"], self.tag_vectors)
+
+        return (
+            CATEGORY_WEIGHT * category_score +
+            TAG_WEIGHT * tag_score +
+            REVIEW_WEIGHT * self.wilson
+        )
+
+    def _dot(self, index, rows, weights, vectors=None):
+        """
+        Sparse matrix-vector product between a catalog index and a
+        {name: weight} profile. Names no game has are ignored.
+
+        With IDF vectors, the profile is IDF-weighted and L2-normalized too,
+        so the product is the cosine similarity of the two.
+        """
+        vec = np.zeros(len(index), dtype=np.float64)
+        for name, weight in weights.items():
+            col = index.columns.get(name)
+            if col is not None:
+                vec[col] = weight
+
+        if vectors is None:
+            return np.bincount(rows, weights=vec[index.indices],
+                               minlength=len(self))
+
+        vec *= vectors.idf
+        norm = np.linalg.norm(vec)
+        if norm > 0:
+            vec /= norm
+        return np.bincount(rows, weights=vec[index.indices] * vectors.values,
+                           minlength=len(self))
+
+    def owned_mask(self, appids):
+        # True for every catalog row whose appid is in `appids`
+        return np.isin(self.appids, np.fromiter(appids, dtype=np.int64))
+
+    def top_k(self, scores, k, exclude=None):
+        """
+        Pick the best k games without sorting the whole catalog.
+
+        Scores are compared after rounding to 4 decimals and ties keep the
+        catalog order, which is the ordering the recommender always exposed.
+
+        Params:
+            scores (np.ndarray): Output of score()
+            k (int): Number of games to return
+            exclude (np.ndarray[bool]): Rows that must not be returned
+
+        Returns:
+            np.ndarray: Catalog row numbers of the winners, best first
+        """
+        candidates = np.arange(len(scores))
+        if exclude is not None:
+            candidates = candidates[~exclude]
+        if k <= 0 or len(candidates) == 0:
+            return candidates[:0]
+
+        values = np.round(scores[candidates], 4)
+        if k < len(candidates):
+            part = np.argpartition(-values, k - 1)[:k]
+            kth = values[part].min()
+
+            above = np.flatnonzero(values > kth)
+            ties = np.flatnonzero(values == kth)[:k - len(above)]
+            keep = np.concatenate((above, ties))
+            candidates = candidates[keep]
+            values = values[keep]
+
+        order = np.lexsort((candidates, -values))
+        return candidates[order]
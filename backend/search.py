@@ -0,0 +1,287 @@
+"""
+Game search over the game_search full-text index (see migrations).
+
+game_search holds the name of every game and item_search the name of every
+tag, developer and publisher, tokenized into trigrams, so any substring of
+three characters or more is an index lookup instead of a LIKE '%...%' scan.
+
+Games are ranked in tiers, each one only read as far as the page needs, so
+a search costs about the same whether a handful of games match or half the
+catalog does:
+    1. Names starting with the query, alphabetically (games_name index)
+    2. Names containing the query
+    3. Games of the tags, developers or publishers containing the query
+Tiers 2 and 3 are in appid order. If they do not fill the page, the words
+of the query Steam has never used in a name or tag are corrected to the
+closest ones that it has (see Dictionary), and the corrected query fills
+the rest.
+"""
+import json
+import re
+import threading
+from collections import Counter, defaultdict
+
+import connections
+import migrations
+import recommender
+
+_filename = "steam_games.db"
+
+MAX_LIMIT = 100
+# Tags, developers and publishers matched per search
+MAX_ITEMS = 50
+# Minimum trigram similarity of a misspelled word and its correction
+MIN_SIMILARITY = 0.3
+
+_WORD = re.compile(r"\w+")
+
+# item_search kind (see migrations.SEARCH_KINDS) -> relation, id column
+_RELATIONS = {
+    migrations.SEARCH_KINDS["tags"]: ("game_tags", "tid"),
+    migrations.SEARCH_KINDS["developers"]: ("game_developers", "did"),
+    migrations.SEARCH_KINDS["publishers"]: ("game_publishers", "pid"),
+}
+
+_dictionary = None
+_dictionary_lock = threading.Lock()
+
+
+def normalize(query):
+    # Lowercase, single spaces
+    return " ".join(query.lower().split())
+
+
+def trigrams(word):
+    # Padded like pg_trgm, so the start and end of short words count
+    word = f"  {word} "
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+
+def similarity(a, b):
+    # Jaccard similarity of two trigram sets
+    common = len(a & b)
+    return common / (len(a) + len(b) - common)
+
+
+class Dictionary:
+    """
+    Every word of the catalog's names and tags, with a trigram index to find
+    the closest known word of a misspelled one.
+
+    Built from the names and tags of the in-memory catalog and never
+    modified: get_dictionary() builds a new one when they change.
+    """
+
+    def __init__(self, catalog):
+        self.names = names = catalog.names
+        self.tag_names = catalog.tags.names
+        raw = names.data.tobytes()
+        offsets = names.offsets.tolist()
+        text = b"\n".join(raw[a:b] for a, b in zip(offsets, offsets[1:]))
+        # Occurrences of every word, the most used correction wins ties
+        counts = Counter(_WORD.findall(text.decode("utf-8").lower()))
+        for c in range(len(catalog.tags.names)):
+            counts.update(_WORD.findall(catalog.tags.names[c].lower()))
+
+        # Numbers are matched as substrings, never corrected
+        self.counts = {w: n for w, n in counts.items()
+                       if len(w) >= 3 and not w.isdigit()}
+        self.words = list(self.counts)
+        self.grams = defaultdict(list)  # trigram -> word indexes
+        for i, word in enumerate(self.words):
+            for gram in trigrams(word):
+                self.grams[gram].append(i)
+
+    def correct(self, word):
+        """
+        Returns:
+            string: The known word closest to `word`, itself if it is
+                known, or None if no known word is close enough
+        """
+        if word in self.counts or len(word) < 3 or word.isdigit():
+            return word
+
+        grams = trigrams(word)
+        candidates = set()
+        for gram in grams:
+            candidates.update(self.grams.get(gram, ()))
+
+        best, best_key = None, None
+        for i in candidates:
+            other = self.words[i]
+            score = similarity(grams, trigrams(other))
+            key = (score, self.counts[other])
+            if score >= MIN_SIMILARITY and (best_key is None or
+                                            key > best_key):
+                best, best_key = other, key
+        return best
+
+    def correct_query(self, query):
+        """
+        Returns:
+            string: The query with every misspelled word corrected, or None
+                if it has none that could be corrected
+        """
+        changed = False
+
+        def fix(match):
+            nonlocal changed
+            word = match.group(0)
+            corrected = self.correct(word)
+            if corrected is None or corrected == word:
+                return word
+            changed = True
+            return corrected
+
+        corrected = _WORD.sub(fix, query)
+        return corrected if changed else None
+
+
+def get_dictionary():
+    """
+    Dictionary of the game cache, rebuilt whenever its names or tags change.
+    Catalogs that only differ in prices share them (see
+    Catalog.with_price), so a price change keeps the dictionary.
+    """
+    global _dictionary
+    recommender.ensure_cache_loaded()
+
+    catalog = recommender.GAME_CACHE
+    dictionary = _dictionary
+    if not _current(dictionary, catalog):
+        with _dictionary_lock:
+            dictionary = _dictionary
+            if not _current(dictionary, catalog):
+                dictionary = Dictionary(catalog)
+                _dictionary = dictionary
+    return dictionary
+
+
+def _current(dictionary, catalog):
+    # Whether a dictionary was built from the catalog's names and tags
+    return (dictionary is not None and dictionary.names is catalog.names and
+            dictionary.tag_names is catalog.tags.names)
+
+
+def search(query, limit=20, offset=0):
+    """
+    Games matching a search query, best first
+
+    Params:
+        query (string): Part of a name, tag, developer or publisher
+        limit (int): Number of games to return, at most MAX_LIMIT
+        offset (int): Number of best games to skip, for pagination
+
+    Returns:
+        list[dict]: {appid, name, price, header_image}
+    """
+    query = normalize(query)
+    limit = min(limit, MAX_LIMIT)
+    if not query or limit <= 0:
+        return []
+
+    depth = offset + limit
+    with connections.read(_filename) as conn:
+        appids = _matches(conn, query, depth)
+
+        if len(appids) < depth:
+            corrected = get_dictionary().correct_query(query)
+            if corrected is not None:
+                seen = set(appids)
+                appids += [a for a in _matches(conn, corrected, depth)
+                           if a not in seen]
+
+        return _games(conn, appids[offset:depth])
+
+
+def _matches(conn, query, depth):
+    # The first `depth` appids of every tier, best first
+    appids = []
+    seen = set()
+
+    def add(rows):
+        for (appid,) in rows:
+            if appid not in seen:
+                seen.add(appid)
+                appids.append(appid)
+
+    # Range of the games_name index: name >= query and name < next string
+    upper = _prefix_end(query)
+    if upper is None:
+        rows = conn.execute("""
+                            SELECT appid FROM games
+                            WHERE name >= ? COLLATE NOCASE
+                            ORDER BY name COLLATE NOCASE
+                            LIMIT ?
+                            """, (query, depth))
+    else:
+        rows = conn.execute("""
+                            SELECT appid FROM games
+                            WHERE name >= ? COLLATE NOCASE
+                              AND name < ? COLLATE NOCASE
+                            ORDER BY name COLLATE NOCASE
+                            LIMIT ?
+                            """, (query, upper, depth))
+    add(rows)
+
+    # Shorter than a trigram: only prefixes can use an index
+    if len(query) < 3:
+        return appids[:depth]
+
+    # With the trigram tokenizer, a quoted string matches as a substring
+    phrase = '"' + query.replace('"', '""') + '"'
+    if len(appids) < depth:
+        # Read in rowid order: FTS5 stops after LIMIT, nothing is sorted
+        add(conn.execute("""
+                         SELECT rowid FROM game_search
+                         WHERE game_search MATCH ?
+                         LIMIT ?
+                         """, (phrase, depth + len(appids))))
+
+    if len(appids) < depth:
+        # Games of the tags, developers and publishers named like the
+        # query, closest names first
+        items = conn.execute("""
+                             SELECT rowid, name FROM item_search
+                             WHERE item_search MATCH ?
+                             LIMIT ?
+                             """, (phrase, MAX_ITEMS)).fetchall()
+        items.sort(key=lambda item: (item[1].lower() != query,
+                                     not item[1].lower().startswith(query),
+                                     len(item[1])))
+        for rowid, _ in items:
+            if len(appids) >= depth:
+                break
+            relation, idname = _RELATIONS[rowid % 4]
+            add(conn.execute(f"""
+                             SELECT appid FROM {relation}
+                             WHERE {idname} = ?
+                             ORDER BY appid
+                             LIMIT ?
+                             """, (rowid // 4, depth + len(appids))))
+    return appids[:depth]
+
+
+def _prefix_end(prefix):
+    # Smallest string after every string starting with prefix, or None if
+    # there is none (prefix is only U+10FFFF). Surrogates cannot be encoded
+    # for sqlite, so the successor of U+D7FF is U+E000.
+    prefix = prefix.rstrip("\U0010ffff")
+    if not prefix:
+        return None
+    code = ord(prefix[-1]) + 1
+    if 0xD800 <= code <= 0xDFFF:
+        code = 0xE000
+    return prefix[:-1] + chr(code)
+
+
+def _games(conn, appids):
+    rows = conn.execute("""
+                        SELECT g.appid, g.name, g.price, g.header_image
+                        FROM json_each(?) AS j
+                        JOIN games g ON g.appid = j.value
+                        ORDER BY j.key
+                        """, (json.dumps(list(appids)),)).fetchall()
+    return [{"appid": appid, "name": name, "price": price,
+             "header_image": header_image}
+            for appid, name, price, header_image in rows]
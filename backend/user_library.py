@@ -0,0 +1,240 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import connections
+import scheduler
+from SteamWebAPI import instance as steamapi
+
+_filename = "steam_games.db"
+
+# A stored library older than this (seconds) is refreshed from Steam
+MAX_AGE = float(os.getenv("LIBRARY_MAX_AGE", 6 * 60 * 60))
+# Serve a stale library right away and refresh it in the background,
+# instead of waiting for Steam
+STALE_WHILE_REVALIDATE = os.getenv("LIBRARY_STALE_WHILE_REVALIDATE",
+                                   "1") != "0"
+
+_refresh_pool = ThreadPoolExecutor(max_workers=4)
+_refreshing = set()  # steamids with a background refresh in flight
+_refreshing_lock = threading.Lock()
+
+
+def diff_library(stored, games):
+    """
+    Changes turning a stored library into a new one
+
+    Params:
+        stored (dict): {appid: playtime} currently in the database
+        games (dict): {appid: playtime} fetched from Steam
+
+    Returns:
+        (list, list, list): [(appid, playtime)] to insert, [appid] to
+            delete, [(appid, playtime)] whose playtime changed
+    """
+    inserts, updates = [], []
+    for appid, playtime in games.items():
+        if appid not in stored:
+            inserts.append((appid, playtime))
+        elif stored[appid] != playtime:
+            updates.append((appid, playtime))
+    deletes = [appid for appid in stored if appid not in games]
+    return inserts, deletes, updates
+
+
+def store_library(steamid, games):
+    """
+    Store a user's library and mark it as synced.
+
+    Only the games that were added, removed or played since the stored copy
+    are written, in one transaction.
+
+    Params:
+        steamid: The user's steamid
+        games (dict): {appid: playtime}
+
+    Returns:
+        (int, dict): The user's sync version, bumped only if something
+            changed, and the number of {inserted, deleted, updated} games
+    """
+    steamid = str(steamid)
+    games = {int(appid): playtime for appid, playtime in games.items()}
+    with connections.write(_filename) as conn:
+        cur = conn.cursor()
+        stored = dict(cur.execute("""
+                                  SELECT appid, playtime FROM user_owned_games
+                                  WHERE user_id = ?
+                                  """, (steamid,)))
+        inserts, deletes, updates = diff_library(stored, games)
+
+        cur.executemany("""
+                        INSERT INTO user_owned_games (user_id, appid, playtime)
+                        VALUES (?, ?, ?)
+                        """, [(steamid, a, p) for a, p in inserts])
+        cur.executemany("""
+                        DELETE FROM user_owned_games
+                        WHERE user_id = ? AND appid = ?
+                        """, [(steamid, a) for a in deletes])
+        cur.executemany("""
+                        UPDATE user_owned_games SET playtime = ?
+                        WHERE user_id = ? AND appid = ?
+                        """, [(p, steamid, a) for a, p in updates])
+        version = _mark_synced(cur, steamid,
+                               bool(inserts or deletes or updates))
+        conn.commit()
+
+    return version, {"inserted": len(inserts), "deleted": len(deletes),
+                     "updated": len(updates)}
+
+
+def _mark_synced(cur, steamid, changed):
+    # The version only moves when the library did, so that a sync finding
+    # nothing new keeps the rankings and cached answers built from it
+    cur.execute("""
+                INSERT INTO user_sync (user_id, synced_at, version)
+                VALUES (?, ?, 1)
+                ON CONFLICT (user_id) DO UPDATE
+                SET synced_at = excluded.synced_at,
+                    version = version + ?
+                """, (steamid, time.time(), int(changed)))
+    return cur.execute("SELECT version FROM user_sync WHERE user_id = ?",
+                       (steamid,)).fetchone()[0]
+
+
+def sync_library(steamid, priority=scheduler.INTERACTIVE):
+    """
+    Fetch a user's library from the Steam Web API and store it
+
+    Returns:
+        (dict, dict): {appid: playtime} and the number of {inserted,
+            deleted, updated} games, or (None, None) if Steam did not answer
+    """
+    try:
+        owned = steamapi.GetOwnedGames(steamid, priority)
+    except requests.RequestException as e:
+        print(f"Failed to fetch the library of {steamid}: {e}")
+        return None, None
+    if not owned:
+        return None, None
+
+    games = owned["games"]
+    _, changes = store_library(steamid, games)
+    return games, changes
+
+
+def get_sync_state(steamid):
+    """
+    Returns:
+        (float, int): When the user's library was last synced and its sync
+            version, or (None, 0) if it never was
+    """
+    with connections.read(_filename) as conn:
+        cur = conn.cursor()
+        row = cur.execute("""
+                          SELECT synced_at, version FROM user_sync
+                          WHERE user_id = ?
+                          """, (str(steamid),)).fetchone()
+    return row if row else (None, 0)
+
+
+def get_stored_library(steamid):
+    # {appid: playtime} of the stored copy of a user's library
+    with connections.read(_filename) as conn:
+        cur = conn.cursor()
+        rows = cur.execute("""
+                           SELECT appid, playtime FROM user_owned_games
+                           WHERE user_id = ?
+                           """, (str(steamid),)).fetchall()
+    return dict(rows)
+
+
+def get_library(steamid, max_age=None, stale_while_revalidate=None):
+    """
+    A user's library, read from the database.
+
+    Steam is only asked when the stored copy is older than max_age. With
+    stale_while_revalidate the stored copy is returned at once and the
+    refresh runs in the background; otherwise the caller waits for it, and
+    gets the stored copy if Steam does not answer. A user that was never
+    synced is fetched in the background.
+
+    Params:
+        steamid: The user's steamid
+        max_age (float): Seconds, defaults to MAX_AGE
+        stale_while_revalidate (bool): Defaults to STALE_WHILE_REVALIDATE
+
+    Returns:
+        dict: {appid: playtime}, or None if the user was never synced
+    """
+    if max_age is None:
+        max_age = MAX_AGE
+    if stale_while_revalidate is None:
+        stale_while_revalidate = STALE_WHILE_REVALIDATE
+
+    synced_at, _ = get_sync_state(steamid)
+    if synced_at is None:
+        refresh_in_background(steamid)
+        return None
+
+    if time.time() - synced_at > max_age:
+        if stale_while_revalidate:
+            refresh_in_background(steamid)
+        else:
+            games, _ = sync_library(steamid)
+            if games is not None:
+                return games
+
+    return get_stored_library(steamid)
+
+
+def get_library_version(steamid, max_age=None, stale_while_revalidate=None):
+    """
+    Sync version of the library get_library would return now, without
+    reading it. A stale library is refreshed in the background, as
+    get_library would.
+
+    Params:
+        Same as get_library
+
+    Returns:
+        int: The sync version, or None if the user was never synced or
+            get_library would wait for Steam
+    """
+    if max_age is None:
+        max_age = MAX_AGE
+    if stale_while_revalidate is None:
+        stale_while_revalidate = STALE_WHILE_REVALIDATE
+
+    synced_at, version = get_sync_state(steamid)
+    if synced_at is None:
+        return None
+
+    if time.time() - synced_at > max_age:
+        if not stale_while_revalidate:
+            return None
+        refresh_in_background(steamid)
+
+    return version
+
+
+def refresh_in_background(steamid):
+    # Queue a refresh of a user's library, unless one is already running
+    steamid = str(steamid)
+    with _refreshing_lock:
+        if steamid in _refreshing:
+            return
+        _refreshing.add(steamid)
+
+    def refresh():
+        try:
+            sync_library(steamid, scheduler.BACKGROUND)
+        except Exception as e:
+            print(f"Failed to refresh the library of {steamid}: {e}")
+        finally:
+            with _refreshing_lock:
+                _refreshing.discard(steamid)
+
+    _refresh_pool.submit(refresh)
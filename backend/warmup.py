@@ -0,0 +1,56 @@
+import threading
+import time
+
+import Db
+import recommender
+import search
+
+_state = {"status": "cold", "started_at": None, "finished_at": None,
+          "error": None}
+_lock = threading.Lock()
+
+
+def run():
+    """
+    Load everything the first requests need: the game cache, the indexes
+    built from it and the games table's column names
+    """
+    with _lock:
+        if _state["status"] in ("warming", "ready"):
+            return
+        _state.update(status="warming", started_at=time.time(), error=None)
+
+    try:
+        recommender.ensure_cache_loaded()
+        recommender.get_gem_index()
+        recommender.get_filter_index()
+        recommender.get_similarity_index()
+        search.get_dictionary()
+        Db.instance.get_game_table_column_names()
+    except Exception as e:
+        print(f"Warm-up failed: {e}")
+        with _lock:
+            _state.update(status="failed", finished_at=time.time(),
+                          error=str(e))
+        return
+
+    with _lock:
+        _state.update(status="ready", finished_at=time.time())
+
+
+def start():
+    # Warm up in a background thread, so the server can accept requests
+    threading.Thread(target=run, name="warmup", daemon=True).start()
+
+
+def state():
+    """
+    Returns:
+        dict: {status (cold, warming, ready or failed), seconds, error}
+    """
+    with _lock:
+        out = dict(_state)
+    started, finished = out.pop("started_at"), out.pop("finished_at")
+    if started is not None:
+        out["seconds"] = (finished or time.time()) - started
+    return out
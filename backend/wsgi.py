@@ -0,0 +1,20 @@
+"""
+Production entry point: several worker processes sharing one catalog.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+The app is loaded once in the gunicorn master (preload_app), which
+extracts the database if needed (see main.prepare_db) and publishes the
+catalog as a shared segment (see catalog_segment) before forking. Every
+worker starts with the segment already mapped read-only, so memory does
+not grow with the worker count.
+"""
+import os
+
+os.environ.setdefault("SHARED_CATALOG", "1")
+
+import warmup  # noqa: E402
+from main import app  # noqa: E402
+
+# Warmed up before forking: workers are ready as soon as they start
+warmup.run()